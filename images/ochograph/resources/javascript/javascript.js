@@ -26,39 +26,47 @@ var autoReload = false;
 //    }
 //}
 
+// Streams the lines logged by a pod after the given line number into the given element, as they are logged, until
+// abort() is called on the returned request.
+function followLog(node, rootPath, after, element) {
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', rootPath + '/pod/log?' + $.param({podId: node, after: after, follow: 1, _: new Date().getTime()}));
+    xhr.onprogress = function() {
+        element.html(xhr.responseText);
+    };
+    xhr.onload = xhr.onprogress;
+    xhr.send();
+    return xhr;
+}
+
 function nodeClicked(node, rootPath) {
+    // Info and logs in one go, the logs being then followed.
     $.ajax({
-      url: rootPath + '/pod/info',
+      url: rootPath + '/pod/details',
       data: {podId: node},
       cache: false
     })
     .done(function(html) {
         $("#theDialog").empty().append(html);
-        // Once done retrieving the info, lets us get the logs.
-        $.ajax({
-          url: rootPath + '/pod/log',
-          data: {podId: node},
-          cache: false
-        })
-        .done(function(html) {       
-            $("#theDialog").append(html).dialog({
-              modal: true,
-              buttons: {
-                    Close: function(){
-                        $(this).dialog("close");
-                    }
-                },
-              maxHeight: 600,
-              width: 800,
-              open: function() {
-                $('.ui-widget-overlay').addClass('custom-overlay');
-              },
-              close: function() {
-                $('.ui-widget-overlay').removeClass('custom-overlay');
-              },
-              title: node
-            });
-        
+        var logs = $("<div></div>").appendTo("#theDialog");
+        var xhr = followLog(node, rootPath, $("#theDialog .podLogEnd").data("after"), logs);
+        $("#theDialog").dialog({
+          modal: true,
+          buttons: {
+                Close: function(){
+                    $(this).dialog("close");
+                }
+            },
+          maxHeight: 600,
+          width: 800,
+          open: function() {
+            $('.ui-widget-overlay').addClass('custom-overlay');
+          },
+          close: function() {
+            xhr.abort();
+            $('.ui-widget-overlay').removeClass('custom-overlay');
+          },
+          title: node
         });
     });
 }
@@ -81,49 +89,80 @@ function getNowFormated() {
     return "" + hours + ":" + (minutes<10?"0":"") +  minutes + ":" + (seconds<10?"0":"") + seconds + ", " + day + " " + monthNames[monthIndex] + " " + year;
 }
 
-var contentData = undefined;
+function showLoadError() {
+    $("#theContent").empty().append("<span class=\"title\">Ochograph</span><br/><br/><span class=\"fail\">Error (re-)loading content, please try to reload the page manually.</span>")
+}
+
+// Has the snapshot with the given version rendered by the server.
+function renderContent(withImage, rootPath, version) {
+    var theUrl = undefined;
+    if (withImage) {
+        theUrl = rootPath + '/image/content';
+    }
+    else {
+        theUrl = rootPath + '/text/content';
+    }
+    $.ajax({
+      url: theUrl,
+      data: {version: version},
+      cache: false
+    })
+    .done(function(html) {
+        $("#theContent").empty().append(html);
+        $("#lastCheckDate").empty().append(getNowFormated());
+        $("#lastUpdateDate").empty().append(getNowFormated());
+    })
+    .fail(function() {
+        showLoadError();
+    });
+}
+
+// The server pushes a 'snapshot' event whenever the pods change (and a 'check' event after each refresh that did not
+// change anything), so that the content is only re-rendered when needed. Browsers without Server-Sent Events fall back
+// to polling the version of the data.
 function loadContent(withImage, rootPath) {
+    if (!window.EventSource) {
+        pollContent(withImage, rootPath);
+        return;
+    }
+    var source = new EventSource(rootPath + '/events');
+    source.addEventListener('snapshot', function(e) {
+        renderContent(withImage, rootPath, e.data);
+    });
+    source.addEventListener('check', function(e) {
+        $("#lastCheckDate").empty().append(getNowFormated());
+    });
+    source.onerror = function() {
+        // The browser reconnects by itself (sending the last version it got), unless the connection was closed for good.
+        if (source.readyState == EventSource.CLOSED) {
+            showLoadError();
+        }
+    };
+}
+
+var contentVersion = undefined;
+function pollContent(withImage, rootPath) {
     $.ajax({
-        dataType: "json",
+        method: 'HEAD',
         url: rootPath + '/data',
         cache: false,
-        success: function (data) {
-                    dataString = JSON.stringify(data);
-                    if (dataString != contentData) {
-                        contentData = dataString;
-                        var theUrl = undefined;
-                        if (withImage) {
-                            theUrl = rootPath + '/image/content';
-                        }
-                        else {
-                            theUrl = rootPath + '/text/content';
-                        }
-                        $.ajax({
-                          url: theUrl,
-                          method: 'POST',
-                          contentType: 'application/json',
-                          cache: false,
-                          data: dataString
-                        })
-                        .done(function(html) {
-                            $("#theContent").empty().append(html);
-                            $("#lastCheckDate").empty().append(getNowFormated());
-                            $("#lastUpdateDate").empty().append(getNowFormated());
-                        });
+        success: function (data, textStatus, jqXHR) {
+                    var version = jqXHR.getResponseHeader('X-Snapshot-Version');
+                    if (version != contentVersion) {
+                        contentVersion = version;
+                        renderContent(withImage, rootPath, version);
                     }
                     else {
                         $("#lastCheckDate").empty().append(getNowFormated());
                     }
-                    
                 },
         error: function (jqXHR, textStatus, errorThrown) {
-                $("#theContent").empty().append("<span class=\"title\">Ochograph</span><br/><br/><span class=\"fail\">Error (re-)loading content, please try to reload the page manually.</span>")
+                showLoadError();
             },
         complete: function() {
                 window.setTimeout(function() {
-                    loadContent(withImage, rootPath);
+                    pollContent(withImage, rootPath);
                 }, reloadIntervalInSeconds * 1000);    
             }
     });
-        
-}
\ No newline at end of file
+}
@@ -14,24 +14,67 @@ import logging
 import requests
 import time
 import sys
-import string
-import random
+import re
 import os
 import struct
 import cgi
+import hashlib
 import BaseHTTPServer
 import urlparse
+import asyncore
+import socket
+import gzip
+import zlib
+import email.utils
+import functools
+import bisect
 
 from logging import Formatter
 from logging.handlers import RotatingFileHandler
 from kazoo.client import KazooClient
-from threading import Thread
+from threading import Thread, Lock, RLock, Event, Condition
 from requests.exceptions import Timeout as HTTPTimeout
 from networkx.readwrite import json_graph
 from SocketServer import ThreadingMixIn
+from Queue import Queue
+from collections import deque, OrderedDict
+from cStringIO import StringIO
 from subprocess import Popen, PIPE
 
 ROOT_NODE = "ROOT" 
+ZK_ROOT = '/ochopod/clusters'
+POOL_SIZE = 32
+INTERACTIVE_POOL_SIZE = 8
+ENGINE = 'pool'
+CONCURRENCY = 256
+POD_TIMEOUT = 10.0
+MIN_TIMEOUT = 0.5
+BREAKER_FAILURES = 3
+BREAKER_BACKOFF = 30.0
+BREAKER_MAX_BACKOFF = 600.0
+DEADLINE = 15.0
+STAGE_INTERVAL = 1.0
+MAX_CYCLES = 10
+RENDER_CACHE_SIZE = 64
+IMAGE_STORE_SIZE = 64
+IMAGE_TTL = 300.0
+DELTA_HISTORY = 16
+SESSION_IDLE = 600.0
+COMPRESS_MIN_SIZE = 1024
+ENCODED_CACHE_SIZE = 256
+LOG_LINES = 1000
+LOG_TAILS = 64
+LOG_REFRESH = 2.0
+LOG_FOLLOW = 300.0
+REPLY_CACHE_SIZE = 256
+REPLY_TTLS = {'info': 10.0, 'log': 2.0}
+REPLY_NEGATIVE_TTL = 5.0
+REPLY_MAX_STALE = 60.0
+ASSET_DIRS = ['css', 'javascript']
+ASSET_TYPES = {'.css': 'text/css', '.js': 'text/javascript', '.png': 'image/png'}
+ASSET_MAX_AGE = 31536000
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
 LOG_FILE = "ochograph.log"
 
 logger = logging.getLogger()
@@ -50,12 +93,76 @@ class bcolors:
     #HEADER = '\033[95m'
     #OKBLUE = '\033[94m'
     OKGREEN = '\033[92m'
-    #WARNING = '\033[93m'
+    WARNING = '\033[93m'
     FAIL = '\033[91m'
     ENDC = '\033[0m'
     #BOLD = '\033[1m'
     #UNDERLINE = '\033[4m'
-    
+
+
+# Returns a regular expression matching any of the given words, built as a trie so that matching does not depend on
+# the number of words, e.g. ['ab', 'ac'] gives 'a(?:b|c)'.
+def get_trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = True
+
+    def _pattern(node):
+        end = node.pop('', False)
+        branches = [re.escape(c) + _pattern(kid) for c, kid in sorted(node.items())]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not end:
+            return branches[0]
+        return '(?:%s)%s' % ('|'.join(branches), '?' if end else '')
+
+    return _pattern(trie)
+
+
+class _Escaper(object):
+    """
+    Turns the text output into HTML in a single pass: the special characters, spaces and new lines are escaped, the
+    colours (see bcolors) become spans and the given node names (if any) are wrapped by link(), the longest name
+    matching first so that e.g. 'cr-app #3' is not found in 'cr-app #31'.
+    """
+
+    # See https://wiki.python.org/moin/EscapingHtml
+    table = {
+        "&": "&amp;",
+        '"': "&quot;",
+        "'": "&apos;",
+        ">": "&gt;",
+        "<": "&lt;",
+        " ": "&nbsp;",
+        "\n": "<br/>",
+        bcolors.OKGREEN: '<span class="okGreen">',
+        bcolors.FAIL: '<span class="fail">',
+        bcolors.WARNING: '<span class="pending">',
+        bcolors.ENDC: '</span>',
+    }
+
+    def __init__(self, nodes=(), link=None):
+
+        tokens = '|'.join(re.escape(token) for token in sorted(self.table, key=len, reverse=True))
+        if nodes:
+            tokens = '(?<![\w.])(?P<node>%s)(?![\w.])|%s' % (get_trie_pattern(nodes), tokens)
+        self.pattern = re.compile(tokens)
+        self.link = link
+        self.plain = _Escaper() if nodes else self
+
+    def _replace(self, match):
+
+        if match.lastgroup == 'node':
+            return self.link(match.group(), self.plain.escape(match.group()))
+        return self.table[match.group()]
+
+    def escape(self, text):
+
+        return self.pattern.sub(self._replace, text) if text else text
+
 # See http://coreygoldberg.blogspot.ch/2013/01/python-verify-png-file-and-get-image.html
 def get_image_info(data):
     if is_png(data):
@@ -67,338 +174,1804 @@ def get_image_info(data):
     return width, height
 
 
-def is_png(data):
-    return (data[:8] == '\211PNG\r\n\032\n'and (data[12:16] == 'IHDR'))
+def is_png(data):
+    return (data[:8] == '\211PNG\r\n\032\n'and (data[12:16] == 'IHDR'))
+
+# From Ochopod
+def shell(snippet, cwd=None, env=None):
+    """
+    Helper invoking a shell command and returning its stdout broken down by lines as a list. The sub-process
+    exit code is also returned. Please note we only pipe stdout (stderr being redirected to /dev/null).
+
+    :type snippet: str
+    :param snippet: shell snippet, e.g "echo foo > /bar"
+    :type env: dict
+    :param env: optional environment passed to POpen
+    :type cwd: str
+    :param cwd: optional working directory passed to POpen
+    :rtype: (int, list) 2-uple
+    """
+
+    out = []
+    pid = Popen('%s 2>/dev/null' % snippet, close_fds=True, shell=True, stdout=PIPE, stderr=None, cwd=cwd, env=env)
+    while True:
+        code = pid.poll()
+        line = pid.stdout.readline()
+        if not line and code is not None:
+            break
+        elif line:
+            out += [line.rstrip('\n')]
+
+    code = pid.returncode
+    return code, out
+
+
+class _Metrics(object):
+    """
+    Registry of counters, gauges and histograms rendered in the Prometheus text format (see /metrics). Updating a
+    series only takes a lock and an addition (plus a bisection for histograms), which is cheap enough to be left on.
+    Histograms keep a count per bucket, the cumulative counts being only computed when rendered.
+    """
+
+    def __init__(self):
+
+        self.lock = Lock()
+        self.names = []
+        self.meta = {}
+        self.series = {}
+
+    def declare(self, name, kind, help, buckets=LATENCY_BUCKETS):
+
+        self.names.append(name)
+        self.meta[name] = (kind, help, buckets)
+        self.series[name] = {}
+
+    def inc(self, name, value=1, **labels):
+
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+
+        #
+        # - one count per bucket plus +Inf, followed by the sum
+        #
+        buckets = self.meta[name][2]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series[name]
+            if key not in series:
+                series[key] = [0] * (len(buckets) + 2)
+            counts = series[key]
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+
+        def labels(key):
+            if not key:
+                return ''
+            escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in key)
+
+        out = []
+        with self.lock:
+            for name in self.names:
+                kind, help, buckets = self.meta[name]
+                out.append('# HELP %s %s\n# TYPE %s %s\n' % (name, help, name, kind))
+                for key, value in sorted(self.series[name].items()):
+                    if kind != 'histogram':
+                        out.append('%s%s %s\n' % (name, labels(key), value))
+                        continue
+
+                    total = 0
+                    for bound, count in zip([repr(float(bound)) for bound in buckets] + ['+Inf'], value[:-1]):
+                        total += count
+                        out.append('%s_bucket%s %d\n' % (name, labels(key + (('le', bound),)), total))
+                    out.append('%s_sum%s %r\n' % (name, labels(key), value[-1]))
+                    out.append('%s_count%s %d\n' % (name, labels(key), total))
+
+        return ''.join(out)
+
+
+_metrics = _Metrics()
+_metrics.declare('ochograph_lookup_pods_seconds', 'histogram', 'Time spent looking the pods up in Zookeeper.')
+_metrics.declare('ochograph_get_pods_details_seconds', 'histogram', 'Time spent getting the pods details (lookup and queries).')
+_metrics.declare('ochograph_pod_query_seconds', 'histogram', 'Latency of the queries to the pods, whatever their outcome.')
+_metrics.declare('ochograph_pod_queries_total', 'counter', 'Queries to the pods by outcome.')
+_metrics.declare('ochograph_graph_build_seconds', 'histogram', 'Time spent building or updating the dependency graph.')
+_metrics.declare('ochograph_get_output_seconds', 'histogram', 'Time spent producing the text output.')
+_metrics.declare('ochograph_draw_image_graphviz_seconds', 'histogram', 'Time spent laying the image out with graphviz.')
+_metrics.declare('ochograph_render_png_seconds', 'histogram', 'Time spent drawing the image.')
+_metrics.declare('ochograph_errors_total', 'counter', 'Calls that raised an exception by function.')
+_metrics.declare('ochograph_http_requests_total', 'counter', 'HTTP requests by method and status.')
+_metrics.declare('ochograph_http_response_bytes', 'histogram', 'Size of the HTTP responses (headers included).', SIZE_BUCKETS)
+_metrics.declare('ochograph_http_in_flight', 'gauge', 'HTTP requests being handled.')
+
+# Decorator recording the duration of each call in the given histogram (see _Metrics), and the calls that raised.
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            ts = time.time()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                _metrics.inc('ochograph_errors_total', function=fn.__name__)
+                raise
+            finally:
+                _metrics.observe(name, time.time() - ts)
+        return wrapper
+    return decorate
+
+
+class _CountingFile(object):
+    """
+    File object wrapper counting the bytes written through it (see /metrics).
+    """
+
+    def __init__(self, out):
+
+        self.out = out
+        self.count = 0
+
+    def write(self, data):
+
+        self.count += len(data)
+        self.out.write(data)
+
+    def __getattr__(self, name):
+
+        return getattr(self.out, name)
+    
+class _Topology(object):
+    """
+    Long-lived Zookeeper session mirroring the /ochopod/clusters tree in memory. Child watches track the clusters
+    and their pods while a data watch on each pod keeps its hints current, which means lookups are answered locally
+    without any round trip to Zookeeper. The hints are also indexed by pod key (e.g. 'dev.cr-app #31').
+    """
+
+    def __init__(self, zk_hosts):
+
+        self.lock = RLock()
+        self.clusters = {}
+        self.keys = {}
+        self.watching = False
+        self.zk = KazooClient(hosts=zk_hosts)
+        self.zk.start()
+
+        #
+        # - the root may not exist yet if nothing has been deployed, in which case the data watch will
+        #   fire again once it gets created
+        #
+        self.zk.DataWatch(ZK_ROOT, self._on_root)
+
+    def _on_root(self, data, stat, event=None):
+
+        with self.lock:
+            if stat and not self.watching:
+                self.watching = True
+                self.zk.ChildrenWatch(ZK_ROOT, self._on_clusters)
+
+    def _on_clusters(self, clusters):
+
+        with self.lock:
+            for cluster in set(self.clusters.keys()) - set(clusters):
+                for hints in self.clusters.pop(cluster).values():
+                    self._unindex(hints)
+
+            for cluster in set(clusters) - set(self.clusters.keys()):
+                pods = self.clusters[cluster] = {}
+                self.zk.DataWatch('%s/%s/pods' % (ZK_ROOT, cluster), self._watch_cluster(cluster, pods))
+
+    def _watch_cluster(self, cluster, pods):
+
+        #
+        # - ochopod creates the cluster node before its pods node, which may therefore not exist yet: the pods are
+        #   only watched once it does, the same way the root is (a child watch set on a missing node just stops)
+        # - should the pods node be deleted the cluster gets a fresh dict, which stops the child watch bound to
+        #   the previous one, and is watched again once it gets re-created
+        #
+        state = {'pods': pods, 'watching': False}
+
+        def _on_cluster(data, stat, event=None):
+            with self.lock:
+                if self.clusters.get(cluster) is not state['pods']:
+                    return False
+
+                if stat is None:
+                    if state['watching']:
+                        for hints in state['pods'].values():
+                            self._unindex(hints)
+                        state['pods'] = self.clusters[cluster] = {}
+                        state['watching'] = False
+
+                elif not state['watching']:
+                    state['watching'] = True
+                    self.zk.ChildrenWatch('%s/%s/pods' % (ZK_ROOT, cluster), self._watch_pods(cluster, state['pods']))
+
+        return _on_cluster
+
+    def _watch_pods(self, cluster, pods):
+
+        #
+        # - each watch is bound to the dict it was created for: if the cluster is removed (and possibly
+        #   re-created later on) the stale watches will simply stop themselves
+        #
+        def _on_pods(kids):
+            with self.lock:
+                if self.clusters.get(cluster) is not pods:
+                    return False
+
+                for kid in set(pods.keys()) - set(kids):
+                    self._unindex(pods.pop(kid))
+
+                for kid in set(kids) - set(pods.keys()):
+                    pods[kid] = None
+                    self.zk.DataWatch('%s/%s/pods/%s' % (ZK_ROOT, cluster, kid), self._watch_hints(cluster, pods, kid))
+
+        return _on_pods
+
+    def _watch_hints(self, cluster, pods, kid):
+
+        def _on_hints(data, stat, event=None):
+            with self.lock:
+                if self.clusters.get(cluster) is not pods or kid not in pods:
+                    return False
+
+                if data is None:
+                    self._unindex(pods.pop(kid))
+                    return False
+
+                try:
+                    hints = \
+                        {
+                            'id': kid,
+                            'cluster': cluster
+                        }
+                    hints.update(json.loads(data))
+                    self._unindex(pods[kid])
+                    pods[kid] = hints
+                    self.keys['%s #%d' % (cluster, hints['seq'])] = hints
+
+                except Exception:
+                    logger.warning('Invalid hints for pod %s in cluster %s' % (kid, cluster), exc_info=True)
+
+        return _on_hints
+
+    def _unindex(self, hints):
+
+        if hints is not None:
+            key = '%s #%d' % (hints['cluster'], hints['seq'])
+            if self.keys.get(key) is hints:
+                del self.keys[key]
+
+    def find(self, key):
+
+        with self.lock:
+            return self.keys.get(key)
+
+    def lookup(self, regex, subset=None):
+
+        pods = {}
+        with self.lock:
+            for cluster, kids in self.clusters.items():
+                if not fnmatch.fnmatch(cluster, regex):
+                    continue
+
+                for hints in kids.values():
+
+                    #
+                    # - the number displayed by the tools (e.g shared.docker-proxy #4) is that monotonic integer
+                    #   derived from zookeeper
+                    #
+                    if hints is None:
+                        continue
+                    seq = hints['seq']
+                    if not subset or seq in subset:
+                        pods['%s #%d' % (cluster, seq)] = hints
+
+        return pods
+
+    def stop(self):
+
+        self.zk.stop()
+        self.zk.close()
+
+
+_topologies = {}
+_topologies_lock = RLock()
+
+# Returns the shared topology for the given Zookeeper host(s), connecting the first time around.
+def get_topology(zk_hosts):
+    with _topologies_lock:
+        if zk_hosts not in _topologies:
+            _topologies[zk_hosts] = _Topology(zk_hosts)
+        return _topologies[zk_hosts]
+
+# Closes the Zookeeper sessions of the topologies created so far (e.g. before exiting).
+def stop_topologies():
+    with _topologies_lock:
+        for topology in _topologies.values():
+            topology.stop()
+        _topologies.clear()
+
+# Lookup all pods registered in Zookeeper (served from the in-memory topology).
+@timed('ochograph_lookup_pods_seconds')
+def lookup_pods(zk_hosts, regex, subset=None):
+    return get_topology(zk_hosts).lookup(regex, subset)
+
+
+class _Pool(object):
+    """
+    Fixed set of worker threads draining a shared queue of tasks (anything with a run() method). This keeps the
+    number of threads flat no matter how many pods we need to query.
+    """
+
+    def __init__(self, size):
+
+        self.queue = Queue()
+        for _ in range(size):
+            worker = Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+
+        while True:
+            task = self.queue.get()
+            try:
+                task.run()
+
+            except Exception:
+                logger.error('Unexpected error running %s' % task, exc_info=True)
+
+    def submit(self, task):
+
+        self.queue.put(task)
+        return task
+
+
+_pool = None
+_interactive_pool = None
+_pool_lock = RLock()
+
+# Returns the shared worker pool, created the first time around with POOL_SIZE threads. The queries made on behalf
+# of a user (e.g. clicking a pod) run on a separate pool of INTERACTIVE_POOL_SIZE threads, so that they never wait
+# behind the queries of a refresh.
+def get_pool(interactive=False):
+    global _pool, _interactive_pool
+    with _pool_lock:
+        if interactive:
+            if not _interactive_pool:
+                _interactive_pool = _Pool(INTERACTIVE_POOL_SIZE)
+            return _interactive_pool
+        if not _pool:
+            _pool = _Pool(POOL_SIZE)
+        return _pool
+
+
+_sessions = {}
+_sessions_lock = RLock()
+
+# Returns the HTTP session (i.e. keep-alive connection pool) dedicated to a given pod endpoint. Sessions
+# idle for more than SESSION_IDLE seconds are dropped since pods come and go.
+def get_session(endpoint):
+    now = time.time()
+    with _sessions_lock:
+        if endpoint not in _sessions:
+            for idle in [e for e, (_, last) in _sessions.items() if now - last > SESSION_IDLE]:
+                _sessions.pop(idle)[0].close()
+
+            session = requests.Session()
+            session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            _sessions[endpoint] = (session, now)
+
+        session = _sessions[endpoint][0]
+        _sessions[endpoint] = (session, now)
+        return session
+
+
+# Used to get the details of a given pod by hitting its API directly. 
+# Copied from Ochothon itself.
+class _Post(object):
+    """
+    We optimize a bit the HTTP queries to the pods by running them on the shared worker pool (this can be a
+    tad slow otherwise for more than 10 queries in a row). Connections are re-used from one query to the next.
+    """
+
+    def __init__(self, key, hints, command, timeout=POD_TIMEOUT, js=None, on_done=None, interactive=False):
+
+        self.key = key
+        self.hints = hints
+        self.command = command
+        self.timeout = timeout
+        self.js = js
+        self.on_done = on_done
+        self.body = None
+        self.code = None
+        self.latency = None
+        self.cancelled = False
+        self.done = Event()
+
+        get_pool(interactive).submit(self)
+
+    def run(self):
+
+        #
+        # - the caller may have given up waiting before the query even started (see cancel()), in which case
+        #   the pod is not queried at all
+        #
+        if self.cancelled:
+            logger.debug('-> %s (cancelled)' % self.key)
+            self.done.set()
+            return
+
+        url = 'N/A'
+        ts = time.time()
+        try:
+            port = self.hints['port']
+            assert port in self.hints['ports'], 'ochopod control port not exposed @ %s (user error ?)' % self.key
+            endpoint = '%s:%d' % (self.hints['ip'], self.hints['ports'][port])
+            url = 'http://%s/%s' % (endpoint, self.command)
+            reply = get_session(endpoint).post(url, timeout=self.timeout, data=self.js)
+            self.body = reply.json()
+            self.code = reply.status_code
+            ms = 1000 * (time.time() - ts)
+            logger.debug('-> %s (HTTP %d, %s ms)' % (url, reply.status_code, int(ms)))
+            logger.debug('Response payload: %s' % self.body)
+
+        except HTTPTimeout:
+            logger.debug('-> %s (timeout)' % url)
+
+        except Exception as failure:
+            logger.debug('-> %s (i/o error, %s)' % (url, failure))
+
+        finally:
+            self.latency = time.time() - ts
+            self.done.set()
+            if self.on_done:
+                self.on_done(self)
+
+    def join(self, timeout=None):
+
+        #
+        # - if we gave up waiting the pod is reported as unreachable, whatever it may answer later on
+        #
+        if not self.done.wait(timeout):
+            return self.key, self.hints['seq'], None, None
+        return self.key, self.hints['seq'], self.body, self.code
+
+    def cancel(self):
+
+        #
+        # - queries already running are left to complete, only the ones still queued are skipped
+        #
+        self.cancelled = True
+
+
+class _AsyncPost(asyncore.dispatcher):
+    """
+    Non-blocking flavor of _Post driven by an asyncore event loop (see fan_out()), which allows a single thread to
+    keep thousands of queries in flight. The exchange is kept minimal: one HTTP/1.0 request whose reply is read
+    until either its Content-Length is reached or the pod closes the connection.
+    """
+
+    def __init__(self, key, hints, command, socket_map, timeout=POD_TIMEOUT, js=None, on_done=None):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+
+        self.key = key
+        self.hints = hints
+        self.command = command
+        self.timeout = timeout
+        self.js = js
+        self.on_done = on_done
+        self.body = None
+        self.code = None
+        self.latency = None
+        self.url = 'N/A'
+        self.started = None
+        self.done = False
+        self.out = ''
+        self.data = []
+
+    def start(self):
+
+        self.started = time.time()
+        try:
+            port = self.hints['port']
+            assert port in self.hints['ports'], 'ochopod control port not exposed @ %s (user error ?)' % self.key
+            ip, port = self.hints['ip'], self.hints['ports'][port]
+            self.url = 'http://%s:%d/%s' % (ip, port, self.command)
+            js = self.js or ''
+            self.out = 'POST /%s HTTP/1.0\r\nHost: %s:%d\r\nContent-Length: %d\r\n\r\n%s' % (self.command, ip, port, len(js), js)
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.connect((ip, port))
+
+        except Exception as failure:
+            self.abort('i/o error, %s' % failure)
+
+    def abort(self, reason):
+
+        logger.debug('-> %s (%s)' % (self.url, reason))
+        self.finish()
+
+    def finish(self):
+
+        #
+        # - the callback is only invoked for queries that were actually started
+        #
+        if not self.done:
+            self.done = True
+            if self.started:
+                self.latency = time.time() - self.started
+                if self.on_done:
+                    self.on_done(self)
+        if self.socket:
+            self.close()
+
+    def writable(self):
+
+        return not self.connected or len(self.out) > 0
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+
+        if self.done:
+            return
+
+        sent = self.send(self.out)
+        self.out = self.out[sent:]
+
+    def handle_read(self):
+
+        chunk = self.recv(65536)
+        if chunk:
+            self.data.append(chunk)
+            if self.parse(complete=False):
+                self.finish()
+
+    def handle_close(self):
+
+        if not self.done:
+            if not self.parse(complete=True):
+                self.abort('i/o error, truncated reply')
+            self.finish()
+
+    def handle_error(self):
+
+        if not self.done:
+            self.abort('i/o error, %s' % sys.exc_info()[1])
+
+    def parse(self, complete):
+
+        #
+        # - returns True once the whole reply has been read and decoded
+        # - the reply is read until the connection is closed unless a Content-Length is specified
+        #
+        raw = ''.join(self.data)
+        head, sep, payload = raw.partition('\r\n\r\n')
+        if not sep:
+            return False
+
+        lines = head.split('\r\n')
+        headers = dict((k.strip().lower(), v.strip()) for k, _, v in (line.partition(':') for line in lines[1:]))
+        if 'content-length' in headers:
+            if len(payload) < int(headers['content-length']):
+                return False
+        elif not complete:
+            return False
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            payload = _dechunk(payload)
+
+        self.body = json.loads(payload)
+        self.code = int(lines[0].split()[1])
+        logger.debug('-> %s (HTTP %d, %s ms)' % (self.url, self.code, int(1000 * (time.time() - self.started))))
+        logger.debug('Response payload: %s' % self.body)
+        return True
+
+    @staticmethod
+    def fan_out(pods, command, timeouts, deadline, concurrency, js=None, on_done=None, progress=None):
+
+        #
+        # - at most <concurrency> sockets are open at any time, the backlog being drained as queries complete
+        # - poll() is used since select() cannot cope with more than 1024 file descriptors
+        # - each pod has its own timeout (POD_TIMEOUT if not in <timeouts>)
+        # - the replies received so far are handed to progress() (if any) every STAGE_INTERVAL
+        #
+        socket_map = {}
+        posts = [_AsyncPost(key, hints, command, socket_map, timeouts.get(key, POD_TIMEOUT), js, on_done) for key, hints in pods.items()]
+        backlog = list(reversed(posts))
+        active = []
+        staged = time.time()
+        while (backlog or active) and time.time() < deadline:
+            while backlog and len(active) < concurrency:
+                post = backlog.pop()
+                post.start()
+                active.append(post)
+
+            asyncore.loop(timeout=0.05, use_poll=True, map=socket_map, count=1)
+
+            now = time.time()
+            for post in active:
+                if not post.done and now - post.started > post.timeout:
+                    post.abort('timeout')
+            active = [post for post in active if not post.done]
+            if progress and now - staged >= STAGE_INTERVAL and (backlog or active):
+                progress([(post.key, post.hints['seq'], post.body, post.code) for post in posts if post.done])
+                staged = now
+
+        for post in backlog + active:
+            post.finish()
+
+        return [(post.key, post.hints['seq'], post.body, post.code) for post in posts]
+
+
+# Decodes a payload sent with 'Transfer-Encoding: chunked'.
+def _dechunk(payload):
+    out = []
+    while payload:
+        size, _, payload = payload.partition('\r\n')
+        size = int(size.split(';')[0], 16)
+        if not size:
+            break
+        out.append(payload[:size])
+        payload = payload[size + 2:]
+    return ''.join(out)
+
+
+class _Health(object):
+    """
+    Health of a given pod. Its latency is smoothed along with its deviation, as TCP does for its retransmission
+    timeout, the timeout of the next query being derived from both and doubled (up to POD_TIMEOUT) after each failure.
+    BREAKER_FAILURES failures in a row (timeouts or i/o errors, an HTTP error meaning that the pod is alive) open a
+    circuit breaker: the pod is then not queried anymore until a retry time, after which a single query probes it
+    with the full POD_TIMEOUT, the backoff doubling each time it fails again.
+    """
+
+    def __init__(self):
+
+        self.lock = RLock()
+        self.srtt = None
+        self.rttvar = None
+        self.rto = POD_TIMEOUT
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry = 0.0
+        self.seen = time.time()
+
+    def timeout(self):
+
+        return POD_TIMEOUT if self.is_open() else self.rto
+
+    def is_open(self):
+
+        return self.failures >= BREAKER_FAILURES
+
+    def allow(self):
+
+        #
+        # - when the breaker is open only one probe goes through once the retry time is reached
+        #
+        with self.lock:
+            now = time.time()
+            self.seen = now
+            if not self.is_open():
+                return True
+            if now < self.retry:
+                return False
+            self.retry = now + self.backoff
+            return True
+
+    def record(self, post):
+
+        with self.lock:
+            if post.code is None:
+                self.failures += 1
+                self.rto = min(POD_TIMEOUT, 2 * self.rto)
+                if self.is_open():
+                    self.backoff = min(BREAKER_MAX_BACKOFF, max(BREAKER_BACKOFF, 2 * self.backoff))
+                    self.retry = time.time() + self.backoff
+                return
+
+            if self.srtt is None:
+                self.srtt, self.rttvar = post.latency, post.latency / 2
+            else:
+                self.rttvar += 0.25 * (abs(self.srtt - post.latency) - self.rttvar)
+                self.srtt += 0.125 * (post.latency - self.srtt)
+            self.rto = min(POD_TIMEOUT, max(MIN_TIMEOUT, self.srtt + 4 * self.rttvar))
+            self.failures = 0
+            self.backoff = 0.0
+
+
+_health = {}
+_health_lock = RLock()
+
+# Returns the health of a given pod, created the first time around. Pods not queried for a while are dropped since
+# they most likely are gone.
+def get_health(key):
+    now = time.time()
+    with _health_lock:
+        if key not in _health:
+            for gone in [k for k, health in _health.items() if now - health.seen > 2 * BREAKER_MAX_BACKOFF]:
+                del _health[gone]
+            _health[key] = _Health()
+        return _health[key]
+
+# Returns the pods whose circuit breaker is open, with the number of failures in a row, e.g. {'dev.cr-app #31': 4}.
+def get_breakers():
+    with _health_lock:
+        return dict((key, health.failures) for key, health in _health.items() if health.is_open())
+
+
+# Queries the given pods and returns their replies as a list of (key, seq, body, code) tuples, code being None for the
+# pods that could not be reached. If given, progress() is called every STAGE_INTERVAL with the replies received so far
+# while some are still outstanding (from the calling thread).
+def query_pods(pods, command, js=None, progress=None):
+    deadline = time.time() + DEADLINE
+    
+    #
+    # - the pods whose breaker is open are reported as unreachable right away
+    # - the others are queried with a timeout adapted to their latency, which is then recorded
+    #
+    health = dict((key, get_health(key)) for key in pods)
+    skipped = [key for key in pods if not health[key].allow()]
+    if skipped:
+        logger.debug('Skipping %d pod(s) known to be unreachable: %s' % (len(skipped), ', '.join(sorted(skipped))))
+        _metrics.inc('ochograph_pod_queries_total', len(skipped), outcome='skipped')
+    
+    def record(post):
+        health[post.key].record(post)
+        _metrics.observe('ochograph_pod_query_seconds', post.latency)
+        _metrics.inc('ochograph_pod_queries_total', outcome='ok' if post.code == 200 else 'error' if post.code else 'unreachable')
+    
+    live = dict((key, hints) for key, hints in pods.items() if key not in skipped)
+    if ENGINE == 'async':
+        timeouts = dict((key, health[key].timeout()) for key in live)
+        out = _AsyncPost.fan_out(live, command, timeouts, deadline, CONCURRENCY, js, record, progress)
+    else:
+        threads = [_Post(pod, hints, command, timeout=health[pod].timeout(), js=js, on_done=record) for pod, hints in live.items()]
+        if progress:
+            staged = time.time()
+            for thread in threads:
+                while not thread.done.wait(max(0.0, min(deadline, staged + STAGE_INTERVAL) - time.time())):
+                    if time.time() >= deadline:
+                        break
+                    progress([other.join(0) for other in threads if other.done.is_set()])
+                    staged = time.time()
+        out = [thread.join(max(0.0, deadline - time.time())) for thread in threads]
+        
+        #
+        # - whatever is still queued once the deadline has passed must not hold up the next queries
+        #
+        for thread in threads:
+            if not thread.done.is_set():
+                thread.cancel()
+
+    out += [(key, pods[key]['seq'], None, None) for key in skipped]
+    unreachable = [key for (key, _, _, code) in out if code is None and key not in skipped]
+    if unreachable:
+        logger.warning('%d pod(s) unreachable or still outstanding after %s seconds: %s' % (len(unreachable), DEADLINE, ', '.join(sorted(unreachable))))
+    return out
+
+
+class _Reply(object):
+    """
+    Reply of a pod to a given command, as cached by _ReplyCache. Timeouts, i/o and HTTP errors are failed replies.
+    """
+
+    def __init__(self, body, code):
+
+        self.body = body
+        self.code = code
+        self.stamp = time.time()
+        self.ok = code is not None and code < 400
+        self.revalidating = False
+
+
+class _ReplyCache(object):
+    """
+    Bounded cache of the replies of the pods, per pod and command, so that a pod a few people are looking at (most
+    likely because it is struggling) is not queried again and again. Replies are fresh for REPLY_TTLS seconds
+    (REPLY_NEGATIVE_TTL for failed ones). Past that they are still served, for up to REPLY_MAX_STALE seconds, while
+    a single query to the pod revalidates them in the background.
+    """
+
+    def __init__(self, size):
+
+        self.lock = RLock()
+        self.replies = _LRU(size)
+
+    def store(self, post):
+
+        self.replies.put((post.key, post.command), _Reply(post.body, post.code))
+
+    def get(self, key, hints, command):
+
+        reply = self.replies.get((key, command))
+        if not reply:
+            return None
+
+        age = time.time() - reply.stamp
+        ttl = REPLY_TTLS.get(command, 0.0) if reply.ok else REPLY_NEGATIVE_TTL
+        if age < ttl:
+            return reply
+        if age > ttl + REPLY_MAX_STALE:
+            return None
+
+        with self.lock:
+            if reply.revalidating:
+                return reply
+            reply.revalidating = True
+
+        logger.debug('Revalidating %s for %s' % (command, key))
+        _Post(key, hints, command, on_done=self.store, interactive=True)
+        return reply
+
+
+_reply_cache = None
+_reply_cache_lock = RLock()
+
+# Returns the shared cache of the replies of the pods, created the first time around.
+def get_reply_cache():
+    global _reply_cache
+    with _reply_cache_lock:
+        if not _reply_cache:
+            _reply_cache = _ReplyCache(REPLY_CACHE_SIZE)
+        return _reply_cache
+
+
+# Returns the replies of a given pod (e.g. 'dev.cr-app #31') to the given commands as a dict, None standing for no
+# reply. The commands are sent concurrently, the pod being found from the hints we already know of (no lookup).
+# Replies are served from the cache when possible (see _ReplyCache), except when a payload is sent.
+def query_pod(zk_hosts, key, commands, js=None):
+    hints = get_topology(zk_hosts).find(key)
+    if not hints:
+        return dict.fromkeys(commands)
+    
+    cache = get_reply_cache() if js is None else None
+    replies = {}
+    posts = []
+    for command in commands:
+        reply = cache.get(key, hints, command) if cache else None
+        if reply:
+            replies[command] = reply.body
+        else:
+            posts.append(_Post(key, hints, command, js=js, on_done=cache.store if cache else None, interactive=True))
+    
+    #
+    # - a pod still outstanding is cached as failed, its reply replacing that if it comes later on
+    #
+    deadline = time.time() + POD_TIMEOUT
+    for post in posts:
+        _, _, body, code = post.join(max(0.0, deadline - time.time()))
+        if cache and code is None:
+            cache.store(post)
+        replies[post.command] = body
+    return replies
+
+
+class _Pod(object):
+    """
+    Immutable record of a pod, parsed once from its reply to /info (or from its Zookeeper hints if it did not answer,
+    the code being then None). Only what the graph is built from is kept: the rest of the reply (most notably the
+    metrics) is dropped, /pod/info querying the pod again when asked to.
+    """
+
+    __slots__ = ('key', 'namespace', 'cluster', 'seq', 'ip', 'ports', 'process', 'dependencies', 'code')
+
+    def __init__(self, key, seq, body, code):
+
+        #
+        # - 'dev.cr-app #31' is cluster 'cr-app' in namespace 'dev'
+        # - the dependencies may be found in various places depending on the ochopod version, None meaning that
+        #   they are not exposed
+        #
+        namespace, _, cluster = key[0:key.find('#') - 1].rpartition('.')
+        dependencies = body.get('dependencies', body.get('dependsOn', (body.get('metrics') or {}).get('dependsOn')))
+        values = (key, namespace, cluster, seq, body.get('ip'), body.get('ports') or None, body.get('process'), dependencies, code)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+
+        raise AttributeError('pod records are immutable')
+
+    @property
+    def path(self):
+
+        return self.namespace + '.' + self.cluster
+
+    def to_json(self):
+
+        #
+        # - same (seq, body, code) layout as the replies, so that it can be parsed back
+        #
+        body = dict((name, getattr(self, name)) for name in ('ip', 'ports', 'process', 'dependencies') if getattr(self, name) is not None)
+        return [self.seq, body, self.code]
+
+    def unresolved(self):
+
+        #
+        # - the same record without code, i.e. the last known details of a pod that stopped answering
+        #
+        if self.code is None:
+            return self
+        seq, body, _ = self.to_json()
+        return _Pod(self.key, seq, body, None)
+
+
+class _Resolver(object):
+    """
+    Index used to resolve the pods dependencies. Each pod record (see _Pod) is filed under its
+    '<namespace>.<cluster>' path: exact dependencies are then a dict lookup while wildcard ones are matched once,
+    using a compiled pattern, against the distinct paths (which are far fewer than the pods). Pods declaring the
+    same wildcard share the result.
+    """
+
+    def __init__(self, pods_details=None):
+
+        self.pods = {}
+        self.paths = {}
+        self.wildcards = {}
+
+        if pods_details:
+            for key, value in pods_details.items():
+                self.add(key, value)
+
+    def add(self, key, pod):
+
+        path = pod.path
+        self.pods[key] = pod
+        if path not in self.paths:
+            self.paths[path] = {}
+            for regex, matches in self.wildcards.values():
+                if regex.match(path):
+                    matches.add(path)
+
+        self.paths[path][key] = pod
+        return pod
+
+    def remove(self, key):
+
+        pod = self.pods.pop(key)
+        path = pod.path
+        del self.paths[path][key]
+        if not self.paths[path]:
+            del self.paths[path]
+            for _, matches in self.wildcards.values():
+                matches.discard(path)
+
+        return pod
+
+    def match(self, where):
+
+        #
+        # - compile and match each distinct wildcard only once, the set of matching paths being then kept
+        #   up-to-date as paths get added or removed
+        #
+        if where not in self.wildcards:
+            regex = re.compile(fnmatch.translate(where))
+            self.wildcards[where] = regex, set(path for path in self.paths if regex.match(path))
+        return self.wildcards[where][1]
+
+    # Returns the records (see _Pod) of the pods matching the given dependencies, None if there are none.
+    def resolve(self, depends_on, namespace):
+
+        if not depends_on:
+            return None
+
+        result = []
+        for dep in depends_on:
+            # Absolute dependency.
+            if dep.startswith("/"):
+                where = dep[1:]
+            else:
+                where = namespace + "." + dep
+
+            if "*" in where:
+                for path in self.match(where):
+                    result.extend(self.paths[path].values())
+            elif where in self.paths:
+                result.extend(self.paths[where].values())
+
+        if len(result) > 0:
+            return result
+        else:
+            return None
+
+# Returns the replies of the pods from the local hardcoded config (for dev only, since no access to Zookeeper), as a
+# dict of (seq, body, code) tuples keyed by pod ID.
+def get_local_replies(regex = "*", subset = None, what = "info"):
+    if regex == "*":
+        # For testing (since no access to Zookeeper)
+        pods_details = {u'dev.cr-app #31': (31, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-27.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8085': 31213, u'8080': 31212}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': True}, u'uptime': u'18.67 hours (pid 334)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-27', u'state': u'leader', u'port': u'8080', u'dependencies': [u'/other.db']}, 200),
+                   u'dev.cr-app #34': (34, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'stopped', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
+                   # Uncomment this one to test circular dependencies.
+                   #u'dev.cr-app #35': (35, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'cr-frontend']}, 200),
+                   u'dev.ls-reverse-proxy #4': (4, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.ls-reverse-proxy-2015-10-23-06-48-37.17f0951d-7952-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'80': 80, u'8080': 31614}, u'metrics': {u'uptime': u'0.15 hours (pid 2053)'}, u'application': u'ochopod.dev.ls-reverse-proxy-2015-10-23-06-48-37', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'*-frontend']}, 200),
+                   # This one is not a dependency of cr-frontend because of a different port.
+                   u'dev.cr-app #36': (36, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-75.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.145', u'public': u'', u'ports': {u'8086': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
+                   
+                   # Uncomment this one to test checking pods that do not expose their dependencies.
+                   #u'dev.cr-app #54': (54, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-75.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.145', u'public': u'', u'ports': {u'8086': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080'}, 200),
+                   
+                   u'marathon.portal #63': (63, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochothon.1360ce5e-6789-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8080': 31117, u'9000': 9000}, u'metrics': {u'uptime': u'543.47 hours (pid 48)'}, u'application': u'ochothon', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
+                   u'other.db #88': (88, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochothon.1360ce5e-6789-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8080': 31117, u'9000': 9000}, u'metrics': {u'uptime': u'543.47 hours (pid 48)'}, u'application': u'ochothon', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
+                   u'dev.cr-frontend #8': (8, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45.3a734f5e-7953-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'80': 31497, u'8080': 31496}, u'metrics': {u'uptime': u'0.15 hours (pid 49)'}, u'application': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'cr-app']}, 200),
+                   u'dev.cr-frontend #9': (9, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45.3a734f5e-7953-11e5-b252-065c340003c6', u'process': u'running', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'80': 31499, u'8080': 31500}, u'metrics': {u'uptime': u'0.15 hours (pid 49)', u'dependsOn': [u'cr-app']}, u'application': u'ochopod.dev.cr-frontend-2015-10-23-06-56-46', u'state': u'leader', u'port': u'8080'}, 200)}
+    elif what == 'info':
+        pods_details = {(regex + ' #' + str(subset[0])): (34, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'stopped', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200)}
+    elif what == 'log':
+        lines = ["2015-10-30 17:29:20,138 - DEBUG - model (reactive) : hash -> 97:e9:63:bb:16:69:39:42:ee:28:d1:87:f6:b1:40:f2\n",
+                  "2015-10-30 17:29:20,138 - INFO - model (reactive) : configuring (1 pods, i/o port 8080)\n",
+                  "2015-10-30 17:29:20,139 - DEBUG - control -> http://10.41.85.104:31545/control/check/60\n",
+                  "2015-10-30 17:29:20,139 - DEBUG - model (reactive) : -> /control/check (1 pods)\n",
+                  "2015-10-30 17:29:20,148 - DEBUG - http in -> /control/check\n",
+                  "2015-10-30 17:29:20,363 - WARNING - lifecycle (piped process) : failed to run the pre-check -> ..haproxy/pod/pod.py (62) -> AssertionError (need 1+ downstream listener)\n",
+                  "2015-10-30 17:29:20,364 - DEBUG - http out -> HTTP 406 (0 ms)\n",
+                  "2015-10-30 17:29:20,368 - DEBUG - control <- http://10.41.85.104:31545/control/check/60 (HTTP 406)\n",
+                  "2015-10-30 17:29:20,370 - WARNING - model (reactive) : configuration failed -> ..models/reactive.py (357) -> AssertionError (1+ pods failing the pre-check or unreachable)\n",
+                  "2015-10-30 17:29:21,137 - DEBUG - watcher (dev.cr-frontend) : change detected in dependency\n",
+                  "2015-10-30 17:29:21,376 - DEBUG - model (reactive) : pod update with no hash impact (did we just reconnect to zk ?)\n",
+                  "2015-10-30 21:25:41,462 - DEBUG - http in -> /info\n",
+                  "2015-10-30 21:25:45,480 - DEBUG - http in -> /info\n",
+                  "2015-10-30 21:25:46,848 - DEBUG - http in -> /info\n",
+                  "2015-10-30 21:25:55,128 - DEBUG - http in -> /info\n",
+                  "2015-11-02 08:21:58,081 - DEBUG - http in -> /log\n"]
+        pods_details = {u'dev.cr-app #31': (31, lines, 200)}
+
+    return pods_details
+
+# Returns the pods details as a dict of pod records (see _Pod) keyed by pod ID, e.g. 'dev.cr-app #31', along with the
+# given output (plus possibly a message). The pods that did not answer are kept with their details known already (see
+# known), or else their Zookeeper hints, and no code (see get_unresolved()). If given, progress() is called with the
+# pods details as the replies come in, starting right away with the pods details known already or the hints.
+@timed('ochograph_get_pods_details_seconds')
+def get_pods_details(is_local, output, hide_zookeeper_info, regex = "*", subset = None, known = None, progress = None):
+    if is_local:
+        return dict((key, _Pod(key, *value)) for key, value in get_local_replies(regex, subset).items()), output
+    else:
+        if not zk_hosts:
+            output += "Could not guess Zookeeper host(s), please specify one (e.g. pythong ochograph.py -z 127.0.0.1:2181)\n"
+            return None, output
+            
+        else:
+        
+            if not hide_zookeeper_info:
+                output += "Using Zookeeper host(s): %s" % zk_hosts
+                output += "\n\n"
+        
+            pods = lookup_pods(zk_hosts, regex, subset)
+            known = known or {}
+            staged = dict((key, known.get(key) or _Pod(key, hints['seq'], hints, None)) for key, hints in pods.items())
+            
+            #
+            # - each reply is parsed once, when first received, the body being then dropped
+            # - the pods that do not answer keep their last known details (dependencies included), the hints
+            #   being only used for the pods never seen before
+            #
+            parsed = {}
+            def merge(out):
+                for (key, seq, body, code) in out:
+                    if key not in parsed:
+                        if code:
+                            parsed[key] = _Pod(key, seq, body, code)
+                        elif key in known:
+                            parsed[key] = known[key].unresolved()
+                        else:
+                            parsed[key] = _Pod(key, seq, pods[key], None)
+                pods_details = dict(staged)
+                pods_details.update(parsed)
+                return pods_details
+            
+            if progress:
+                progress(staged)
+            out = query_pods(pods, 'info', progress=progress and (lambda out: progress(merge(out))))
+            
+            return merge(out), output
+            
+                   
+    
+
+# Returns the replies of a given pod to the given commands (see query_pod()), using the local hardcoded
+# config if asked to (see get_local_replies()).
+def get_pod_replies(is_local, key, commands):
+    if not is_local:
+        return query_pod(zk_hosts, key, commands)
+    
+    hash_pos = key.rfind("#")
+    replies = {}
+    for command in commands:
+        details = get_local_replies(key[0:hash_pos - 1], [int(key[hash_pos + 1:])], command)
+        replies[command] = details.values()[0][1] if details else None
+    return replies
+
+class _Changes(object):
+    """
+    What changed between two consecutive updates of the dependency graph (see _GraphMaintainer): the pods that were
+    added, removed or whose dependencies or process status changed, plus the ones whose record changed in any other
+    way. The graph flag tells whether nodes or edges were touched, in which case a new graph instance was produced.
+    """
+
+    def __init__(self):
+
+        self.added = set()
+        self.removed = set()
+        self.dependencies = set()
+        self.status = set()
+        self.updated = set()
+        self.graph = False
+
+    def __nonzero__(self):
+
+        return bool(self.added or self.removed or self.dependencies or self.status or self.updated)
+
+    def __repr__(self):
+
+        return '<changes: %d added, %d removed, %d dependencies, %d status, %d updated>' % \
+            (len(self.added), len(self.removed), len(self.dependencies), len(self.status), len(self.updated))
+
+
+# Returns a structural copy of a DiGraph: DiGraph.copy() deep-copies everything (including the attribute dicts)
+# which is way too slow for our purpose, whereas only the adjacency dicts need to be duplicated here.
+def copy_graph(graph):
+    result = nx.DiGraph()
+    result.graph = dict(graph.graph)
+    result.node = dict((n, dict(attr)) for n, attr in graph.node.items())
+    # DiGraph.edge is yet another alias of the successors.
+    result.succ = result.adj = result.edge = dict((n, dict(nbrs)) for n, nbrs in graph.succ.items())
+    result.pred = dict((n, dict(nbrs)) for n, nbrs in graph.pred.items())
+    return result
+
+
+class _GraphMaintainer(object):
+    """
+    Keeps the dependency graph up-to-date from one set of pods details to the next. Only the pods that were added or
+    whose dependencies changed are resolved again, the pods declaring a dependency (exact or wildcard) matching a new
+    pod simply gaining an edge to it. The graph is copied before being patched so that the instance handed out
+    previously is never modified, and is handed out as-is when nothing structural changed.
+    """
+
+    def __init__(self):
+
+        self.resolver = _Resolver()
+        self.details = {}
+        self.graph = nx.DiGraph()
+        self.forward = {}
+        self.reverse = {}
+        self.declared = {}
+        self.exact = {}
+        self.wildcard = {}
+
+    def _declare(self, key, pod):
+
+        wheres = set()
+        if pod.dependencies:
+            for dep in pod.dependencies:
+                # Absolute dependency.
+                where = dep[1:] if dep.startswith("/") else pod.namespace + "." + dep
+                wheres.add(where)
+                index = self.wildcard if "*" in where else self.exact
+                index.setdefault(where, set()).add(key)
+
+        self.declared[key] = wheres
+
+    def _undeclare(self, key):
+
+        for where in self.declared.pop(key, ()):
+            index = self.wildcard if "*" in where else self.exact
+            index[where].discard(key)
+            if not index[where]:
+                del index[where]
+
+    def _dependents(self, path):
+
+        #
+        # - the pods whose declared dependencies may match a given '<namespace>.<cluster>' path
+        #
+        keys = set(self.exact.get(path, ()))
+        for where, declaring in self.wildcard.items():
+            if path in self.resolver.match(where):
+                keys |= declaring
+        return keys
+
+    @timed('ochograph_graph_build_seconds')
+    def update(self, pods_details):
+
+        changes = _Changes()
+
+        changes.removed = set(key for key in self.details if key not in pods_details)
+        for key, pod in pods_details.items():
+            if key not in self.details:
+                changes.added.add(key)
+            elif pod is not self.details[key]:
+                if pod.dependencies != self.details[key].dependencies:
+                    changes.dependencies.add(key)
+                if pod.process != self.details[key].process:
+                    changes.status.add(key)
+                if pod.to_json() != self.details[key].to_json():
+                    changes.updated.add(key)
+
+        self.details = dict(pods_details)
+        if not (changes.added or changes.removed or changes.dependencies):
+            return self.graph, changes
+
+        #
+        # - first update the index itself
+        # - the edges from/to the removed pods are dropped below thanks to the reverse index
+        #
+        for key in changes.removed:
+            self.resolver.remove(key)
+            self._undeclare(key)
+
+        for key in changes.added:
+            self.resolver.add(key, pods_details[key])
+
+        for key in changes.dependencies:
+            self.resolver.remove(key)
+            self.resolver.add(key, pods_details[key])
+            self._undeclare(key)
+
+        stale = changes.added | changes.dependencies
+        graph = copy_graph(self.graph)
+        touched = set(changes.added)
+        for key in changes.removed:
+            for target in self.forward.pop(key, ()):
+                self.reverse[target].discard(key)
+                touched.add(target)
+            for source in self.reverse.pop(key, ()):
+                if source != key:
+                    self.forward[source].discard(key)
+            graph.remove_node(key)
+
+        edges = []
+        for key in stale:
+            pod = self.resolver.pods[key]
+            self._declare(key, pod)
+            deps = self.resolver.resolve(pod.dependencies, pod.namespace)
+            targets = set(dep.key for dep in deps) if deps else set()
+            logger.debug("Pod: %s, deps: %s", key, sorted(targets))
+            before = self.forward.get(key, set())
+            for target in before - targets:
+                graph.remove_edge(key, target)
+                self.reverse[target].discard(key)
+                touched.add(target)
+            for target in targets - before:
+                edges.append((key, target))
+                self.reverse.setdefault(target, set()).add(key)
+                touched.add(target)
+            self.forward[key] = targets
+
+        # The other pods whose dependencies match a new pod.
+        for key in changes.added:
+            for source in self._dependents(self.resolver.pods[key].path) - stale:
+                edges.append((source, key))
+                self.forward[source].add(key)
+                self.reverse.setdefault(key, set()).add(source)
+
+        # Pods nobody depends on are attached to the root.
+        for key in touched - changes.removed:
+            if not self.reverse.get(key):
+                if not graph.has_edge(ROOT_NODE, key):
+                    edges.append((ROOT_NODE, key))
+            elif graph.has_edge(ROOT_NODE, key):
+                graph.remove_edge(ROOT_NODE, key)
+
+        #
+        # - add the new edges in the order of the pods details, the order in which successors are listed (and
+        #   therefore drawn) being the insertion order
+        #
+        order = dict((key, index) for index, key in enumerate(pods_details.keys()))
+        edges.sort(key=lambda edge: (order[edge[1]], order.get(edge[0], -1)))
+        graph.add_edges_from(edges)
+        if graph.has_node(ROOT_NODE) and not graph.successors(ROOT_NODE):
+            graph.remove_node(ROOT_NODE)
+
+        changes.graph = True
+        self.graph = graph
+        return graph, changes
+
+
+def get_graph_from_pods_details(pods_details):
+    graph, _ = _GraphMaintainer().update(pods_details)
+    return graph
+
+# Returns the pods that did not answer (yet), i.e. which have no code (see get_pods_details()).
+def get_unresolved(pods_details):
+    return sorted(key for key, pod in pods_details.items() if pod.code is None)
+
+# Returns a tuple where the first element is a list of running pod IDs, the second
+# element a list of non-running pod IDs and the third a list of unresolved pod IDs
+def get_nodes_status(graph, pods_details):
+    def is_process_running(pod_id):
+        if pods_details.has_key(pod_id):
+            return "running" == pods_details.get(pod_id).process
+        return False
+    
+    ok_nodes = []
+    ko_nodes = []
+    unresolved_nodes = []
+    
+    for node in nx.nodes(graph):
+        if node != ROOT_NODE:
+            if pods_details.has_key(node) and pods_details.get(node).code is None:
+                unresolved_nodes.append(node)
+            elif is_process_running(node):
+                ok_nodes.append(node)
+            else:
+                ko_nodes.append(node)
+                
+    return ok_nodes, ko_nodes, unresolved_nodes
+
+# Yields the lines of the text tree below the given node, depth first and in the order of the successors, the pods for
+# which is_running() is true being shown in green and the others in red (or in yellow if is_resolved() is given and
+# false). A pod depended upon by several others is shown below each of them. This is iterative (with the current path
+# as visited set, which guards against cycles) so that deep chains do not hit the recursion limit, each line being
+# produced in constant time.
+def draw_tree(graph, is_running, root=ROOT_NODE, is_resolved=None):
+    stack = [(root, iter(graph.successors(root)))]
+    on_path = set([root])
+    while stack:
+        node, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            on_path.discard(node)
+        elif child not in on_path:
+            if is_resolved and not is_resolved(child):
+                color = bcolors.WARNING
+            else:
+                color = bcolors.OKGREEN if is_running(child) else bcolors.FAIL
+            yield '%s%s+-%s%s\n' % ('    ' * (len(stack) - 1), color, child, bcolors.ENDC)
+            stack.append((child, iter(graph.successors(child))))
+            on_path.add(child)
+
+# Returns a list of circular dependencies (each one being a list of pod IDs), with one representative cycle per
+# offending strongly connected component and at most max_cycles overall. Unlike enumerating every simple cycle
+# (which is exponential in the worst case) this is linear in the size of the graph.
+def find_cycles(graph, max_cycles=None):
+    max_cycles = MAX_CYCLES if max_cycles is None else max_cycles
+    cycles = []
+    for component in nx.strongly_connected_components(graph):
+        if len(cycles) >= max_cycles:
+            break
+        
+        start = min(component)
+        if len(component) > 1:
+            cycles.append(find_cycle(graph, component, start))
+        elif graph.has_edge(start, start):
+            cycles.append([start])
+            
+    return cycles
+
+# Returns the shortest cycle going through start within a given strongly connected component (breadth-first
+# search), e.g. ['a', 'b', 'c'] for a --> b --> c --> a.
+def find_cycle(graph, component, start):
+    parents = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for successor in graph.successors(node):
+            if successor == start:
+                cycle = [node]
+                while parents[cycle[-1]] is not None:
+                    cycle.append(parents[cycle[-1]])
+                cycle.reverse()
+                return cycle
+            
+            if successor in component and successor not in parents:
+                parents[successor] = node
+                queue.append(successor)
+                
+    return [start]
+
+def get_no_depends_on(pods_details):
+    result = []
+    for pod_id, pod in pods_details.items():
+        # The dependencies of the pods that did not answer are simply not known.
+        if pod.code is not None and pod.dependencies is None:
+            result.append(pod_id)
+    return result
+ 
+class _Snapshot(object):
+    """
+    Immutable result of a refresh: the pods details, the dependency graph and the /data JSON body, serialized
+    once so that it can be served as-is to any number of clients. Snapshots are numbered, the version being only
+    incremented when the body differs from the previous one (see _Refresher). The first version is the time the
+    snapshot was built in milliseconds, so that versions handed out before a restart never match the new ones.
+    """
+
+    def __init__(self, graph, pods_details, output, previous=None):
+
+        self.version = previous.version + 1 if previous else int(time.time() * 1000)
+        self.graph = graph
+        self.pods_details = pods_details
+        self.output = output
+        # Same graph instance as last time means the same cycles.
+        self.cycles = previous.cycles if previous and previous.graph is graph else find_cycles(graph)
+        self.timestamp = time.time()
+        self.data = {'graph': json_graph.node_link_data(graph), 'podsDetails': dict((key, pod.to_json()) for key, pod in pods_details.items()), 'breakers': get_breakers(), 'unresolved': get_unresolved(pods_details)}
+        self.body = json.dumps(self.data, sort_keys=True)
+        # Serialized deltas from older versions, computed on demand (see get_delta()).
+        self.deltas = {}
+
+    def delta(self, old):
+
+        #
+        # - clients typically all come from the same version, so each delta is only serialized once
+        #
+        if old.version not in self.deltas:
+            self.deltas[old.version] = json.dumps(get_delta(old, self), sort_keys=True)
+        return self.deltas[old.version]
+
+
+# Returns what changed between two snapshots: the nodes and links (as source/target pairs of node ids) added or
+# removed from the graph, plus the pods records added or changed and the ones removed, e.g.
+# {'since': 3, 'version': 4, 'nodes': {'added': [...], 'removed': [...]}, 'links': {...}, 'podsDetails': {'changed': {...}, 'removed': [...]}}
+def get_delta(old, new):
+
+    def links(graph):
+        ids = [n['id'] for n in graph['nodes']]
+        return set((ids[l['source']], ids[l['target']]) for l in graph['links'])
+
+    old_nodes = dict((n['id'], n) for n in old.data['graph']['nodes'])
+    new_nodes = dict((n['id'], n) for n in new.data['graph']['nodes'])
+    old_links = links(old.data['graph'])
+    new_links = links(new.data['graph'])
+    old_pods = old.data['podsDetails']
+    new_pods = new.data['podsDetails']
+
+    return {
+        'since': old.version,
+        'version': new.version,
+        'nodes': {
+            'added': [n for key, n in new_nodes.items() if old_nodes.get(key) != n],
+            'removed': [key for key in old_nodes if key not in new_nodes]},
+        'links': {
+            'added': sorted(new_links - old_links),
+            'removed': sorted(old_links - new_links)},
+        'podsDetails': {
+            'changed': dict((key, value) for key, value in new_pods.items() if old_pods.get(key) != value),
+            'removed': [key for key in old_pods if key not in new_pods]},
+        'breakers': new.data['breakers'],
+        'unresolved': new.data['unresolved']}
+
+
+class _Refresher(Thread):
+    """
+    Background thread rebuilding the snapshot every so often. The web handlers only ever read the latest snapshot,
+    which means the Zookeeper lookup and the queries to the pods do not depend on how many dashboards are open.
+    A new snapshot is only published if something changed, the clients waiting on it being then notified. The build
+    function is passed publish() so that it can publish intermediate snapshots while the pods are being queried.
+    """
+
+    def __init__(self, build, interval):
+        super(_Refresher, self).__init__()
+
+        self.build = build
+        self.interval = interval
+        self.snapshot = None
+        self.history = deque(maxlen=DELTA_HISTORY)
+        self.checked = None
+        self.started = None
+        self.ready = Event()
+        self.changed = Condition()
+        self.daemon = True
+
+        self.start()
+
+    def run(self):
+
+        while True:
+            try:
+                self.started = time.time()
+                self.publish(*self.build(self.publish))
+
+            except Exception:
+                logger.error('Error refreshing the pods details', exc_info=True)
+
+            #
+            # - wake up whoever is waiting, even if nothing changed (this allows them to detect dead clients)
+            #
+            with self.changed:
+                self.checked = time.time()
+                self.changed.notify_all()
+
+            self.ready.set()
+            time.sleep(self.interval)
+
+    def publish(self, graph, pods_details, output, changes):
+
+        #
+        # - nothing to build (let alone serialize) if neither the pods, the graph, the output nor the breakers
+        #   changed since the last update, the current snapshot being then up-to-date
+        #
+        if self.snapshot and not changes and not changes.graph and output == self.snapshot.output and \
+                get_breakers() == self.snapshot.data['breakers']:
+            return
+
+        snapshot = _Snapshot(graph, pods_details, output, previous=self.snapshot)
+        if not self.snapshot or snapshot.body != self.snapshot.body:
+            with self.changed:
+                self.snapshot = snapshot
+                self.history.append(snapshot)
+                self.changed.notify_all()
+
+            self.ready.set()
+            logger.debug('Published snapshot #%d (%d ms)' % (snapshot.version, int(1000 * (time.time() - self.started))))
+
+    def wait(self, version):
+
+        #
+        # - returns right away if the current snapshot is not the given version, otherwise blocks until the
+        #   next refresh (whether it changed anything or not)
+        #
+        with self.changed:
+            if not self.snapshot or self.snapshot.version == version:
+                self.changed.wait()
+            return self.snapshot
+
+    def get(self, timeout=None):
+
+        #
+        # - block until the first refresh completes so that the very first clients do not get an error
+        #
+        self.ready.wait(timeout)
+        return self.snapshot
+
+    def find(self, version, timeout=None):
+
+        #
+        # - returns the snapshot with the given version if still known, the latest one otherwise
+        #
+        snapshot = self.get(timeout)
+        for old in list(self.history):
+            if old.version == version:
+                return old
+        return snapshot
+
+    def since(self, version, timeout=None):
+
+        #
+        # - returns the latest snapshot and the body to send to a client holding the given version: either the
+        #   delta from that version or the full body if it is too old (or unknown, e.g. after a restart)
+        #
+        snapshot = self.get(timeout)
+        if not snapshot:
+            return None, None
+        for old in list(self.history):
+            if old.version == version:
+                return snapshot, snapshot.delta(old)
+        return snapshot, snapshot.body
+
+ 
+class _LRU(object):
+    """
+    Thread-safe dict bounded to a given number of entries, the least recently used ones being evicted first. Entries
+    may also expire after a given number of seconds.
+    """
+
+    def __init__(self, size, ttl=None):
+
+        self.size = size
+        self.ttl = ttl
+        self.lock = RLock()
+        self.entries = OrderedDict()
 
-# From Ochopod
-def shell(snippet, cwd=None, env=None):
-    """
-    Helper invoking a shell command and returning its stdout broken down by lines as a list. The sub-process
-    exit code is also returned. Please note we only pipe stdout (stderr being redirected to /dev/null).
+    def get(self, key):
 
-    :type snippet: str
-    :param snippet: shell snippet, e.g "echo foo > /bar"
-    :type env: dict
-    :param env: optional environment passed to POpen
-    :type cwd: str
-    :param cwd: optional working directory passed to POpen
-    :rtype: (int, list) 2-uple
-    """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            expires, value = self.entries.pop(key)
+            if expires and expires < time.time():
+                return None
+            self.entries[key] = expires, value
+            return value
 
-    out = []
-    pid = Popen('%s 2>/dev/null' % snippet, close_fds=True, shell=True, stdout=PIPE, stderr=None, cwd=cwd, env=env)
-    while True:
-        code = pid.poll()
-        line = pid.stdout.readline()
-        if not line and code is not None:
-            break
-        elif line:
-            out += [line.rstrip('\n')]
+    def put(self, key, value):
 
-    code = pid.returncode
-    return code, out
-    
-# Lookup all pods registered in Zookeeper.
-def lookup_pods(zk_hosts, regex, subset=None):
-    zk = KazooClient(hosts=zk_hosts)
-    zk.start()
-
-    ROOT = '/ochopod/clusters'
-
-    pods = {}
-
-    clusters = [cluster for cluster in zk.get_children(ROOT) if fnmatch.fnmatch(cluster, regex)]
-    for cluster in clusters:
-        kids = zk.get_children('%s/%s/pods' % (ROOT, cluster))
-        for kid in kids:
-            js, _ = zk.get('%s/%s/pods/%s' % (ROOT, cluster, kid))
-            hints = \
-                {
-                    'id': kid,
-                    'cluster': cluster
-                }
-            #
-            # - the number displayed by the tools (e.g shared.docker-proxy #4) is that monotonic integer
-            #   derived from zookeeper
-            #
-            hints.update(json.loads(js))
-            seq = hints['seq']
-            if not subset or seq in subset:
-                pods['%s #%d' % (cluster, seq)] = hints
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl if self.ttl else None), value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
 
-    zk.stop()
-    return pods
 
+# Returns the given bytes gzipped (with no timestamp so that the same input always gives the same output).
+def gzip_bytes(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
 
-# Used to get the details of a given pod by hitting its API directly. 
-# Copied from Ochothon itself.
-class _Post(Thread):
+
+# Tells whether an Accept-Encoding header allows the given coding, e.g. 'gzip' (see RFC 7231, section 5.3.4).
+def accepts_encoding(header, coding):
+    qualities = {}
+    for part in (header or '').split(','):
+        params = [p.strip() for p in part.split(';')]
+        q = 1.0
+        for param in params[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        qualities[params[0].lower()] = q
+    # An explicit mention of the coding takes precedence over '*'.
+    return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+
+# Returns the best coding (gzip or deflate) allowed by an Accept-Encoding header, None if neither is.
+def get_encoding(header):
+    for coding in ['gzip', 'deflate']:
+        if accepts_encoding(header, coding):
+            return coding
+    return None
+
+
+# Returns the given bytes compressed with the given coding (see get_encoding()).
+def encode(data, coding):
+    return gzip_bytes(data) if coding == 'gzip' else zlib.compress(data, 6)
+
+
+class _Asset(object):
     """
-    We optimize a bit the HTTP queries to the pods by running them on separate threads (this can be a
-    tad slow otherwise for more than 10 queries in a row)
+    Static file (stylesheet, script, image) read once and served from memory. Text files are also gzipped upfront.
+    The ETag is derived from the content, its first characters being used to version the URLs the pages refer to.
     """
 
-    def __init__(self, key, hints, command, timeout=10.0, js=None):
-        super(_Post, self).__init__()
-
-        self.key = key
-        self.hints = hints
-        self.command = command
-        self.timeout = timeout
-        self.js = js
-        self.body = None
-        self.code = None
+    def __init__(self, path, ctype):
 
-        self.start()
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.ctype = ctype
+        self.modified = int(os.path.getmtime(path))
+        digest = hashlib.sha1(self.body).hexdigest()
+        self.version = digest[:8]
+        self.etag = '"%s"' % digest
+        self.gzipped = None
+        if ctype.startswith('text/'):
+            gzipped = gzip_bytes(self.body)
+            if len(gzipped) < len(self.body):
+                self.gzipped = gzipped
 
-    def run(self):
 
-        url = 'N/A'
-        try:
-            ts = time.time()
-            port = self.hints['port']
-            assert port in self.hints['ports'], 'ochopod control port not exposed @ %s (user error ?)' % self.key
-            url = 'http://%s:%d/%s' % (self.hints['ip'], self.hints['ports'][port], self.command)
-            reply = requests.post(url, timeout=self.timeout, data=self.js)
-            self.body = reply.json()
-            self.code = reply.status_code
-            ms = 1000 * (time.time() - ts)
-            logger.debug('-> %s (HTTP %d, %s ms)' % (url, reply.status_code, int(ms)))
-            logger.debug('Response payload: %s' % self.body)
+# Returns the static assets found under the given directories (relative to the current one) as a dict keyed by the
+# path they are served under, e.g. '/ochograph/css/style.css'.
+def load_assets(root_path, dirs=ASSET_DIRS):
+    assets = {}
+    for top in dirs:
+        for folder, _, files in os.walk(top):
+            for name in files:
+                ctype = ASSET_TYPES.get(os.path.splitext(name)[1])
+                if ctype:
+                    path = os.path.join(folder, name)
+                    assets['%s/%s' % (root_path, path.replace(os.sep, '/'))] = _Asset(path, ctype)
+    return assets
 
-        except HTTPTimeout:
-            logger.debug('-> %s (timeout)' % url)
 
-        except Exception as failure:
-            logger.debug('-> %s (i/o error, %s)' % (url, failure))
+# Matches the timestamp the pods prefix their log lines with, e.g. '2015-10-30 17:29:20,138'.
+LOG_STAMP = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(,\d+)?')
 
-    def join(self, timeout=None):
+class _LogTail(object):
+    """
+    Ring buffer holding the last LOG_LINES lines of a pod's log, each one numbered and stamped (lines without a
+    timestamp, e.g. stack traces, get the one of the previous line). The pods always return their whole log, which
+    is merged by skipping the lines already known. Fetches are shared by all the clients of a given pod, at most one
+    every LOG_REFRESH seconds, which allows following the log without hammering the pod.
+    """
 
-        Thread.join(self)
-        return self.key, self.hints['seq'], self.body, self.code
+    def __init__(self, fetch):
 
+        self.fetch = fetch
+        self.lines = deque(maxlen=LOG_LINES)
+        self.count = 0
+        self.seen = 0
+        self.fetched = 0
+        self.lock = RLock()
 
+    def _merge(self, lines):
 
-# Returns a list of pods_data, i.e list of ('<pod_name>', '<namespace>', <seq>, ['<depends_on_ip>'], '<pod_id>', ['<ports>'])
-def find_dependencies(pods_dict, depends_on, namespace):
-    if not depends_on:
-        return None
-    else:
-        result = []
-        for pod_key in pods_dict.keys():
-            pod_data = get_pod_data(pod_key, pods_dict.get(pod_key))            
-            
-            for dep in depends_on:
-                where = None
-                # Absolute dependency.
-                if dep.startswith("/"):
-                    where = dep[1:] 
-                else:
-                    where = namespace + "." + dep
-                    
-                pod_path = pod_data[1] + "." + pod_data[0]
-                if "*" in where and fnmatch.fnmatch(pod_path, where):
-                    result.append(pod_data)
-                elif "*" not in where and pod_path == where:
-                    result.append(pod_data)
-                        
-        if len(result) > 0:
-            return result
+        #
+        # - if the log simply grew (our last few lines are still where the previous fetch ended) the new lines are
+        #   the ones past that point, whatever they contain
+        # - otherwise (e.g. the pod truncated its log) look for our last few lines starting from the end, the new
+        #   lines being the ones after them (fewer lines are compared at the very beginning of the log)
+        # - the latter is only a guess: new lines identical to our last ones are then taken as already known, and
+        #   if nothing matches (e.g. empty buffer or a lot logged since) the whole log is taken
+        #
+        known = [entry[2] for entry in list(self.lines)[-3:]]
+        start = 0
+        if known and len(known) <= self.seen <= len(lines) and lines[self.seen - len(known):self.seen] == known:
+            start = self.seen
         else:
-            return None
+            for i in range(len(lines) - 1, -1, -1):
+                first = max(0, i + 1 - len(known))
+                if known and lines[first:i + 1] == known[len(known) - (i + 1 - first):]:
+                    start = i + 1
+                    break
+        self.seen = len(lines)
 
-# Returns a tuple of the form ('<pod_name>', '<namespace>', <seq>, ['<depends_on_ip>'], '<pod_id>', ['<ports>'])
-def get_pod_data(pod_id, value):
-    hash_pos = pod_id.find("#")
-    pod_with_namespace = pod_id[0:hash_pos-1]
-    dot_pos_sum = 0
-    tmp = pod_with_namespace
-    while tmp.find('.') >= 0:
-        dot_pos = tmp.find('.')
-        dot_pos_sum += dot_pos + 1
-        tmp = tmp[dot_pos+1:]
-
-    namespace = pod_with_namespace[0:dot_pos_sum-1]
-    pod = pod_with_namespace[dot_pos_sum:]
-    #seq = pod_id[hash_pos+1:]
-    
+        stamp = self.lines[-1][1] if self.lines else ''
+        for line in lines[start:]:
+            match = LOG_STAMP.match(line)
+            if match:
+                stamp = match.group()
+            self.lines.append((self.count, stamp, line))
+            self.count += 1
 
-    depends_on = None
-    body = value[1]
-    if body.has_key('dependencies'):
-        depends_on = body['dependencies']
-    elif body.has_key('dependsOn'):
-        depends_on = body['dependsOn']
-    elif body.has_key('metrics') and body['metrics'].has_key('dependsOn'):
-        depends_on = body['metrics']['dependsOn']
-        
-    seq =  value[0]
-    
-    ports = None
-    if body.has_key('ports') and body['ports'].keys():
-        ports = body['ports'].keys()
-        
+    def update(self, lines):
 
-    return (pod, namespace, seq, depends_on, pod_id, ports)
+        #
+        # - lines fetched by the caller (e.g. along with other queries to the pod), None if the pod did not reply
+        #
+        with self.lock:
+            self.fetched = time.time()
+            if isinstance(lines, list):
+                self._merge(lines)
+            elif lines is not None:
+                logger.warn('Unexpected log payload: %s' % type(lines).__name__)
 
-# Return the list of pod IDs that depend on a given pod.
-def get_depends_on_me(pod_id, key_with_deps):
-    result = []
-    for kd in key_with_deps.keys():
-        deps = key_with_deps.get(kd)
-        if deps:
-            for dep in deps:
-                if dep[4] == pod_id:
-                    result.append(kd)
-    if len(result) > 0:
-        return result
-    else:
-        return None
-    
-def get_pods_details(is_local, output, hide_zookeeper_info, regex = "*", subset = None, what = "info"):
-    if is_local:
-        if regex == "*":
-            # For testing (since no access to Zookeeper)
-            pods_details = {u'dev.cr-app #31': (31, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-27.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8085': 31213, u'8080': 31212}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': True}, u'uptime': u'18.67 hours (pid 334)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-27', u'state': u'leader', u'port': u'8080', u'dependencies': [u'/other.db']}, 200),
-                       u'dev.cr-app #34': (34, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'stopped', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
-                       # Uncomment this one to test circular dependencies.
-                       #u'dev.cr-app #35': (35, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'cr-frontend']}, 200),
-                       u'dev.ls-reverse-proxy #4': (4, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.ls-reverse-proxy-2015-10-23-06-48-37.17f0951d-7952-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'80': 80, u'8080': 31614}, u'metrics': {u'uptime': u'0.15 hours (pid 2053)'}, u'application': u'ochopod.dev.ls-reverse-proxy-2015-10-23-06-48-37', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'*-frontend']}, 200),
-                       # This one is not a dependency of cr-frontend because of a different port.
-                       u'dev.cr-app #36': (36, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-75.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.145', u'public': u'', u'ports': {u'8086': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
-                       
-                       # Uncomment this one to test checking pods that do not expose their dependencies.
-                       #u'dev.cr-app #54': (54, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-75.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.145', u'public': u'', u'ports': {u'8086': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080'}, 200),
-                       
-                       u'marathon.portal #63': (63, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochothon.1360ce5e-6789-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8080': 31117, u'9000': 9000}, u'metrics': {u'uptime': u'543.47 hours (pid 48)'}, u'application': u'ochothon', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
-                       u'other.db #88': (88, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochothon.1360ce5e-6789-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'8080': 31117, u'9000': 9000}, u'metrics': {u'uptime': u'543.47 hours (pid 48)'}, u'application': u'ochothon', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200),
-                       u'dev.cr-frontend #8': (8, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45.3a734f5e-7953-11e5-b252-065c340003c5', u'process': u'running', u'ip': u'10.41.91.122', u'public': u'', u'ports': {u'80': 31497, u'8080': 31496}, u'metrics': {u'uptime': u'0.15 hours (pid 49)'}, u'application': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45', u'state': u'leader', u'port': u'8080', u'dependsOn': [u'cr-app']}, 200),
-                       u'dev.cr-frontend #9': (9, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-frontend-2015-10-23-06-56-45.3a734f5e-7953-11e5-b252-065c340003c6', u'process': u'running', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'80': 31499, u'8080': 31500}, u'metrics': {u'uptime': u'0.15 hours (pid 49)', u'dependsOn': [u'cr-app']}, u'application': u'ochopod.dev.cr-frontend-2015-10-23-06-56-46', u'state': u'leader', u'port': u'8080'}, 200)}
-        elif what == 'info':
-            pods_details = {(regex + ' #' + str(subset[0])): (34, {u'node': u'patwstmesosdev2.ecs.ads.autodesk.com', u'status': u'', u'task': u'ochopod.dev.cr-app-2015-10-22-12-17-23.a42b56ac-78b7-11e5-b252-065c340003c5', u'process': u'stopped', u'ip': u'10.41.91.123', u'public': u'', u'ports': {u'8085': 32214, u'8080': 32545}, u'metrics': {u'info': {u'leveraging': {u'penalties': {u'file': u'penaltiesDisabled.conf', u'noPenaltyPerfectMatches': True, u'penaltiesLines': [u'*.*.*.*.* -> *.*.*.*.* = 0', u'*.*.*.* -> *.*.*.* = 0', u'*.*.* -> *.*.* = 0', u'*.* -> *.* = 0', u'* -> * = 0']}, u'fuzzyMatching': {u'maxNbNgramMatches': 20000, u'nbNgramMatchesTolerance': 2}}, u'authenticationEnabled': True, u'leader': False}, u'uptime': u'11.52 hours (pid 214)'}, u'application': u'ochopod.dev.cr-app-2015-10-22-12-17-28', u'state': u'leader', u'port': u'8080', u'dependsOn': []}, 200)}
-        elif what == 'log':
-            lines = ["2015-10-30 17:29:20,138 - DEBUG - model (reactive) : hash -> 97:e9:63:bb:16:69:39:42:ee:28:d1:87:f6:b1:40:f2\n",
-                      "2015-10-30 17:29:20,138 - INFO - model (reactive) : configuring (1 pods, i/o port 8080)\n",
-                      "2015-10-30 17:29:20,139 - DEBUG - control -> http://10.41.85.104:31545/control/check/60\n",
-                      "2015-10-30 17:29:20,139 - DEBUG - model (reactive) : -> /control/check (1 pods)\n",
-                      "2015-10-30 17:29:20,148 - DEBUG - http in -> /control/check\n",
-                      "2015-10-30 17:29:20,363 - WARNING - lifecycle (piped process) : failed to run the pre-check -> ..haproxy/pod/pod.py (62) -> AssertionError (need 1+ downstream listener)\n",
-                      "2015-10-30 17:29:20,364 - DEBUG - http out -> HTTP 406 (0 ms)\n",
-                      "2015-10-30 17:29:20,368 - DEBUG - control <- http://10.41.85.104:31545/control/check/60 (HTTP 406)\n",
-                      "2015-10-30 17:29:20,370 - WARNING - model (reactive) : configuration failed -> ..models/reactive.py (357) -> AssertionError (1+ pods failing the pre-check or unreachable)\n",
-                      "2015-10-30 17:29:21,137 - DEBUG - watcher (dev.cr-frontend) : change detected in dependency\n",
-                      "2015-10-30 17:29:21,376 - DEBUG - model (reactive) : pod update with no hash impact (did we just reconnect to zk ?)\n",
-                      "2015-10-30 21:25:41,462 - DEBUG - http in -> /info\n",
-                      "2015-10-30 21:25:45,480 - DEBUG - http in -> /info\n",
-                      "2015-10-30 21:25:46,848 - DEBUG - http in -> /info\n",
-                      "2015-10-30 21:25:55,128 - DEBUG - http in -> /info\n",
-                      "2015-11-02 08:21:58,081 - DEBUG - http in -> /log\n"]
-            pods_details = {u'dev.cr-app #31': (31, lines, 200)}
-            return pods_details, output
-    
-        return pods_details, output
-    else:
-        if not zk_hosts:
-            output += "Could not guess Zookeeper host(s), please specify one (e.g. pythong ochograph.py -z 127.0.0.1:2181)\n"
-            return None, output
-            
-        else:
-        
-            if not hide_zookeeper_info:
-                output += "Using Zookeeper host(s): %s" % zk_hosts
-                output += "\n\n"
-        
-            pods = lookup_pods(zk_hosts, regex, subset)
-            threads = [_Post(pod, hints, what) for pod, hints in pods.items()]
-            out = [thread.join() for thread in threads]
-            pods_details = {key: (seq, body, code) for (key, seq, body, code) in out if code}
-            
-            return pods_details, output
-            
-                   
-    
+    def refresh(self):
 
-def get_graph_from_pods_details(pods_details):
-    key_with_deps = {}
-    
-    for key in pods_details.keys():    
-        pod_data = get_pod_data(key, pods_details.get(key))    
-        deps = find_dependencies(pods_details, pod_data[3], pod_data[1])    
-        key_with_deps[key] = deps    
-        logger.debug("Pod: %s, deps: %s" % (key, deps))
-        
-    # Generate the graph.
-    G = nx.DiGraph()
-    for kd in key_with_deps.keys():
-        depends_on_me = get_depends_on_me(kd, key_with_deps)
-        logger.debug("Pod ID %s has the following depending on it: %s" % (kd, depends_on_me))
-        if not depends_on_me:
-            G.add_edge(ROOT_NODE, kd)
-        else:
-            for dom in depends_on_me:
-                logger.debug("Adding edge (%s, %s)" % (dom, kd))
-                G.add_edge(dom, kd)
-        
-    return G
+        with self.lock:
+            if time.time() - self.fetched >= LOG_REFRESH:
+                self.update(self.fetch())
 
-# Returns a tuple where the first element is a list of running pod IDs and the second
-# element a list of non-running pod IDs 
-def get_nodes_status(graph, pods_details):
-    def is_process_running(pod_id):
-        if pods_details.has_key(pod_id):
-            body = pods_details.get(pod_id)[1]
-            if body.has_key("process"):
-                return "running" == body.get("process")
-        return False
-    
-    ok_nodes = []
-    ko_nodes = []
-    
-    for node in nx.nodes(graph):
-        if node != ROOT_NODE:
-            if is_process_running(node):
-                ok_nodes.append(node)
-            else:
-                ko_nodes.append(node)
-                
-    return ok_nodes, ko_nodes
+    def get(self, tail=None, since=None, after=None):
+
+        #
+        # - returns the (number, timestamp, line) entries matching all the given criteria: the last <tail> ones, the
+        #   ones stamped <since> or later (compared as strings, e.g. '2015-10-30 21:25') and the ones numbered after
+        #   <after>
+        #
+        with self.lock:
+            entries = list(self.lines)
+        if after is not None:
+            entries = [entry for entry in entries if entry[0] > after]
+        if since:
+            entries = [entry for entry in entries if entry[1] >= since]
+        if tail is not None:
+            entries = entries[-tail:] if tail > 0 else []
+        return entries
+
+
+# Returns a canonical hash of everything a render depends on: the mode, the dependency graph (as a list of edges),
+# which pods are running, which ones do not expose their dependencies and which ones did not answer.
+def get_render_key(mode, edges, pods_details):
+    running = sorted(key for key, pod in pods_details.items() if pod.process == 'running')
+    hidden = sorted(get_no_depends_on(pods_details))
+    return hashlib.sha1(json.dumps([mode, sorted(edges), running, hidden, get_unresolved(pods_details)])).hexdigest()
 
-def get_no_depends_on(pods_details):
-    result = []
-    for pod_id in pods_details.keys():
-        pod_data = get_pod_data(pod_id, pods_details.get(pod_id))
-        if pod_data[3] == None:
-            result.append(pod_id)
-    return result
- 
  
 # Returns a tuple with the graph dimensions in the first element, e.g. (0,0,342.99,170.23)
-# and a dict of nodes with their position in the second element
+# and a dict of nodes with their position and size in the second element, e.g. (27.0,18.0,93.6,36.0),
+# everything being in points. This is read from the attributes set by the layout.
 def get_graphviz_info(a_graph):
-    dot_data = a_graph.to_string()
-    assert "pos=\"" in dot_data, 'nodes positions not in graph'
-    
-    bb_start = dot_data.find("bb=\"")
-    g_pos_start = bb_start + 4
-    g_pos_end = dot_data.find("\"", g_pos_start)
-    
-    graph_dims = dot_data[g_pos_start:g_pos_end].split(',')
-    
-    graph_dimension = (float(graph_dims[0]), float(graph_dims[1]), float(graph_dims[2]), float(graph_dims[3]))
+    assert 'bb' in a_graph.graph_attr.keys(), 'graph not laid out'
+    graph_dimension = tuple(float(v) for v in a_graph.graph_attr['bb'].split(','))
     
     nodes_pos = {}
     for n in a_graph.nodes():
-        n_pos = dot_data.find(n)
-        pos_pos = dot_data.find("pos=\"", n_pos)
-        start_coord = pos_pos + 5
-        end_coord = dot_data.find("\"", start_coord)
-        coord = dot_data[start_coord:end_coord].split(',')
-        nodes_pos[n] = (float(coord[0]), float(coord[1]))
+        coord = n.attr['pos'].rstrip('!').split(',')
+        # The node size is in inches.
+        nodes_pos[n] = (float(coord[0]), float(coord[1]), 72 * float(n.attr['width']), 72 * float(n.attr['height']))
         
     return graph_dimension, nodes_pos
     
-# Returns the an AGraph (see http://networkx.lanl.gov/pygraphviz/reference/agraph.html)   
-def draw_image_graphviz(graph, ok_nodes, ko_nodes, image_file):
+# Returns the an AGraph (see http://networkx.lanl.gov/pygraphviz/reference/agraph.html), laid out and ready
+# to be drawn (e.g. A.draw(format='png') returns the image data).
+@timed('ochograph_draw_image_graphviz_seconds')
+def draw_image_graphviz(graph, ok_nodes, ko_nodes, unresolved_nodes=()):
     A = nx.to_agraph(graph)
     
     # See http://www.graphviz.org/doc/info/shapes.html
@@ -417,6 +1990,13 @@ def draw_image_graphviz(graph, ok_nodes, ko_nodes, image_file):
         n.attr['fillcolor']="#FF5555"
         n.attr['color']="#000000"
         n.attr['fontcolor']="#FFFFFF"
+        
+    for unresolved_node in unresolved_nodes:
+        n = A.get_node(unresolved_node)
+        n.attr['style']='filled,dashed'
+        n.attr['fillcolor']="#DDAA00"
+        n.attr['color']="#000000"
+        n.attr['fontcolor']="#FFFFFF"
        
     # Hide root node.
     root_node = A.get_node(ROOT_NODE)
@@ -426,7 +2006,6 @@ def draw_image_graphviz(graph, ok_nodes, ko_nodes, image_file):
     A.remove_node(root_node)
         
     A.layout('dot', args='-Nfontsize=10 -Nwidth="1.3" -Nheight=".5" -Nmargin=0 -Gfontsize=8')
-    A.draw(image_file)
     return A
 
 ####################################################################################################################################
@@ -438,6 +2017,7 @@ if __name__ == '__main__':
     is_http = False
     root_path = ''
     port_number = 9000
+    refresh_interval = 15.0
     log_level = "WARNING"
     no_depends_on = set()
     
@@ -470,6 +2050,46 @@ if __name__ == '__main__':
                     port_number = int(sys.argv[arg_index + 1])
                 except:
                     pass
+            elif arg == '--pool':
+                try:
+                    POOL_SIZE = int(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--engine':
+                try:
+                    ENGINE = sys.argv[arg_index + 1]
+                except:
+                    pass
+            elif arg == '--concurrency':
+                try:
+                    CONCURRENCY = int(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--deadline':
+                try:
+                    DEADLINE = float(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--max-cycles':
+                try:
+                    MAX_CYCLES = int(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--info-ttl':
+                try:
+                    REPLY_TTLS['info'] = float(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--log-ttl':
+                try:
+                    REPLY_TTLS['log'] = float(sys.argv[arg_index + 1])
+                except:
+                    pass
+            elif arg == '--refresh':
+                try:
+                    refresh_interval = float(sys.argv[arg_index + 1])
+                except:
+                    pass
             elif arg == '--log':
                 try:
                     log_level = sys.argv[arg_index + 1]
@@ -527,85 +2147,86 @@ if __name__ == '__main__':
     
     
     
-    def get_graph():
+    # The graph is maintained incrementally from one call to the next if a maintainer is passed. If publish() is
+    # given it is called with the intermediate results while the pods are being queried, the pods that did not
+    # answer yet keeping their last known details.
+    def get_graph(maintainer=None, publish=None):
         output = ""
-        pods_details, output = get_pods_details(is_local, output, hide_zookeeper_info = is_http)
-        G = get_graph_from_pods_details(pods_details)
-        return G, pods_details, output
+        maintainer = maintainer or _GraphMaintainer()
+        
+        def progress(pods_details):
+            G, changes = maintainer.update(pods_details)
+            publish(G, pods_details, output, changes)
+        
+        pods_details, output = get_pods_details(is_local, output, hide_zookeeper_info = is_http, known = maintainer.details, progress = publish and progress)
+        G, changes = maintainer.update(pods_details)
+        return G, pods_details, output, changes
     
     # Return a tuple, the first element is the text output, the second
     # indicates whether the graph could be generated or not and the third 
-    # is the AGraph used to generate the image (None if no image was generated).
-    def get_output(G, pods_details, output, image_path=None):
+    # is the laid out AGraph to draw the image from (None if no image was requested).
+    # The circular dependencies may be passed if already known (see find_cycles()).
+    # The text is passed chunk by chunk to write() if given (e.g. to print it as it goes), in which
+    # case the first element is empty.
+    @timed('ochograph_get_output_seconds')
+    def get_output(G, pods_details, output, with_image=False, cycles=None, write=None):
+        
+        chunks = []
+        emit = write or chunks.append
+        emit(output)
         
         if not G or len(G.nodes()) == 0:
-            output += bcolors.FAIL + 'No pod to show. Have you any pod deployed!?' + bcolors.ENDC + '\n'
-            return output, False, None           
+            emit(bcolors.FAIL + 'No pod to show. Have you any pod deployed!?' + bcolors.ENDC + '\n')
+            return "".join(chunks), False, None           
         else:        
             if is_local:
-                output += "Using local hardcoded config (for dev only).\n\n"
-                #output += json.dumps(pods_details, sort_keys=True, indent=2, separators=(',', ': '))
-                #output += "\n\n"      
+                emit("Using local hardcoded config (for dev only).\n\n")
+                #emit(json.dumps(pods_details, sort_keys=True, indent=2, separators=(',', ': ')))
+                #emit("\n\n")      
             
             # The drawing of the graph will not be accurate in case of circular dependencies, so lets just not draw it.
-            if len(list(nx.simple_cycles(G))) > 0:
-                output += "Cannot draw dependency graph: there is something wrong with your pods config, it seems that you have a circular dependency.\n"
-                output += "Details:\n"
-                for t in list(nx.simple_cycles(G)):
-                    # The last node, which is the same as the first one, is not listed in the list
-                    # returned by simple_cycles, but lets still show it since it makes it more readable. 
-                    first = None
-                    output += "  "
-                    for node in t:
-                        if first is None:
-                            first = node
-                        output += node,
-                        output += " --> "
-                    output += first + "\n"      
-                    first = None
+            if cycles is None:
+                cycles = find_cycles(G)
+            if len(cycles) > 0:
+                emit("Cannot draw dependency graph: there is something wrong with your pods config, it seems that you have a circular dependency.\n")
+                emit("Details:\n")
+                for t in cycles:
+                    # The last node, which is the same as the first one, is not listed in the cycle
+                    # but lets still show it since it makes it more readable. 
+                    emit("  " + " --> ".join(t + [t[0]]) + "\n")
+                if len(cycles) >= MAX_CYCLES:
+                    emit("  (only the first %d circular dependencies are shown)\n" % MAX_CYCLES)
                     
-                return output, False, None
+                return "".join(chunks), False, None
             # No circular dependency, lets proceed...
             else:
-                ok_nodes, ko_nodes = get_nodes_status(G, pods_details)
+                ok_nodes, ko_nodes, unresolved_nodes = get_nodes_status(G, pods_details)
                 no_depends_on_me = get_no_depends_on(pods_details)
                 if len(no_depends_on_me) > 0:
-                    output += bcolors.FAIL + 'The following pods do not expose their dependencies, hence the graph is not reliable: ' + bcolors.ENDC + "\n"
+                    emit(bcolors.FAIL + 'The following pods do not expose their dependencies, hence the graph is not reliable: ' + bcolors.ENDC + "\n")
                     for no_dep in no_depends_on_me:
-                        output += no_dep + "\n\n"
+                        emit(no_dep + "\n\n")
                 
                 def is_process_running(pod_id):
                     if pods_details.has_key(pod_id):
-                        body = pods_details.get(pod_id)[1]
-                        if body.has_key("process"):
-                            return "running" == body.get("process")
+                        return "running" == pods_details.get(pod_id).process
                     return False
-                
-                def draw_children(parent, graph, level, output):
-                    ancestors = nx.ancestors(graph, parent)
-                    for neighbor in nx.all_neighbors(graph, parent):
-                        # all_neighbors() includes both predecessors and successors,
-                        # so we need to make sure we do not enter an infinite loop...
-                        if not neighbor in ancestors:
-                            if is_process_running(neighbor):
-                                color = bcolors.OKGREEN
-                            else:
-                                color = bcolors.FAIL
-                            output += ('{spacer}' + color + '+-{t}').format(spacer='    ' * level, t=neighbor) + bcolors.ENDC + "\n"
-                            output = draw_children(neighbor, graph, level + 1, output)
-                    return output
                     
                 A = None
-                if image_path:
-                    A = draw_image_graphviz(G, ok_nodes, ko_nodes, image_path)
+                if with_image:
+                    A = draw_image_graphviz(G, ok_nodes, ko_nodes, unresolved_nodes)
                 else:                        
-                    output = draw_children(ROOT_NODE, G, 0, output)
-                    output +=  '\n'
+                    unresolved = set(unresolved_nodes)
+                    for line in draw_tree(G, is_process_running, is_resolved=lambda pod_id: pod_id not in unresolved):
+                        emit(line)
+                    emit('\n')
                 
                
-                output += "Pods with a running process are shown in " + bcolors.OKGREEN + "green" + bcolors.ENDC + ", those with a non-running process in " + bcolors.FAIL+ "red" + bcolors.ENDC + ".\n"
+                emit("Pods with a running process are shown in " + bcolors.OKGREEN + "green" + bcolors.ENDC + ", those with a non-running process in " + bcolors.FAIL+ "red" + bcolors.ENDC + ".\n")
+                if unresolved_nodes:
+                    emit("Pods that did not answer (yet) are shown in " + bcolors.WARNING + "yellow" + bcolors.ENDC + ", their dependencies being unknown.\n")
                 
-                return output, True, A
+                return "".join(chunks), True, A
                 
 
     
@@ -619,70 +2240,277 @@ if __name__ == '__main__':
         
         HOST_NAME = ''
         
+        maintainer = _GraphMaintainer()
+        refresher = _Refresher(lambda publish: get_graph(maintainer, publish), refresh_interval)
+        renders = _LRU(RENDER_CACHE_SIZE)
+        images = _LRU(IMAGE_STORE_SIZE, ttl=IMAGE_TTL)
+        encoded = _LRU(ENCODED_CACHE_SIZE)
+        log_tails = _LRU(LOG_TAILS)
+        assets = load_assets(root_path)
+        logger.debug('Loaded %d static assets' % len(assets))
+        
         class MyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
-            # See https://wiki.python.org/moin/EscapingHtml
-            html_escape_table = {
-                "&": "&amp;",
-                '"': "&quot;",
-                "'": "&apos;",
-                ">": "&gt;",
-                "<": "&lt;",
-            }
+            escaper = _Escaper()
             
             def escape_html(self, text):
-                if not text:
-                    return text
-                result = "".join(self.html_escape_table.get(c,c) for c in text)
-                result = result.replace(" ", '&nbsp;')
-                result = result.replace(bcolors.OKGREEN, '<span class="okGreen">')
-                result = result.replace(bcolors.FAIL, '<span class="fail">')
-                result = result.replace(bcolors.ENDC, '</span>')    
-                result = result.replace("\n", '<br/>')
-               
-                return result       
+                return self.escaper.escape(text)
             
-            def get_random_image_name(self):
-                def id_generator(size=8, chars=string.ascii_uppercase + string.digits):
-                    return ''.join(random.choice(chars) for _ in range(size))
+            # Wraps a (HTML escaped) node name so that clicking it shows the pod details.
+            def link_node(self, node, escaped):
+                return "<span class=\"textNodeLink\" onclick=\"nodeClicked('%s', '%s');\">%s</span>" % (node, root_path, escaped)
+            
+            # Renders a graph as a (html, png, image_map) tuple, the last two being None in text mode or if the graph
+            # could not be drawn.
+            def render(self, graph, pods_details, with_image, cycles=None):
+                output, graph_generated, a_graph = get_output(graph, pods_details, "", with_image, cycles)
+                
+                # Allow clicking a pod in text mode as well.
+                nodes = [n for n in graph.nodes() if n != ROOT_NODE]
+                output_escaped = _Escaper(nodes, self.link_node).escape(output)
+                        
+                if not (with_image and graph_generated):
+                    return output_escaped, None, None
+                
+                # Straight to memory, the size being read from the PNG header.
+                ts = time.time()
+                data = a_graph.draw(format='png')
+                _metrics.observe('ochograph_render_png_seconds', time.time() - ts)
+                image_info = get_image_info(data)                       
+
+                graphviz_info = get_graphviz_info(a_graph)
+                
+                g_width = graphviz_info[0][2] - graphviz_info[0][0]
+                g_height = graphviz_info[0][3] - graphviz_info[0][1] 
+                
+                # We need to compare the image size with the dimensions of the graph to properly
+                # calculate nodes positions on the image.
+                ratio_w = g_width / image_info[0]
+                ratio_h = g_height / image_info[1]
+                
+                
+                image_map = '<map name="map1">'
+                for node in graphviz_info[1].keys():
+                    v = graphviz_info[1].get(node)
+                    # Graphviz has its origin at the bottom left corner.
+                    x = (v[0] - graphviz_info[0][0]) / ratio_w
+                    y = image_info[1] - ((v[1] - graphviz_info[0][1]) / ratio_h)
+                    area_width = v[2] / ratio_w
+                    area_height = v[3] / ratio_h
+                    x1 = x - (area_width / 2)
+                    y1 = y - (area_height / 2)
+                    x2 = x + (area_width / 2)
+                    y2 = y + (area_height / 2)
+                    image_map += '<area shape="rect" coords="%s,%s,%s,%s" href="javascript: void(0);" onclick="nodeClicked(\'%s\', \'%s\');">' % (int(x1), int(y1), int(x2), int(y2), node, root_path)
+                image_map += '</map>'
+                
+                return output_escaped, data, image_map
+                
+            # Pushes a 'snapshot' event to the client (Server-Sent Events) whenever a new snapshot is published, its
+            # data being the snapshot version, until the client goes away. A 'check' event is sent after refreshes that
+            # did not change anything, which is how dead clients get detected.
+            def push_events(self, version):
+                try:
+                    while True:
+                        snapshot = refresher.wait(version)
+                        if snapshot and snapshot.version != version:
+                            version = snapshot.version
+                            self.wfile.write("id: %d\nevent: snapshot\ndata: %d\n\n" % (version, version))
+                        else:
+                            self.wfile.write("event: check\ndata: %d\n\n" % version)
+                        self.wfile.flush()
+                        
+                except socket.error:
+                    logger.debug('Client gone, no longer pushing events')
+                
+            # Returns the content (text or image) for the given graph as a (render key, html) tuple, the graph being
+            # only built (by calling build(), which returns the graph and its circular dependencies if known) if not
+            # rendered already.
+            def get_content(self, with_image, edges, pods_details, build):
+                out = StringIO()
+                self.write_nice_title(out);
+                
+                out.write("<span class=\"small\" title=\"Last time a check was made in the background to see if what you see is still up-to-date.\">Last check date: <span id=\"lastCheckDate\"></span></span><br/>")
+                out.write("<span class=\"small\" title=\"Last time what you see on the screen was updated, i.e. something changed in the pods settings.\">Last update date: <span id=\"lastUpdateDate\"></span></span><br/>")
+                if with_image:
+                    out.write("<span class=\"small\"><a href=\"%s/text\">Go to text mode</a></span><br/><br/>" % root_path)
+                else:
+                    out.write("<span class=\"small\"><a href=\"%s/image\">Go to image mode</a></span><br/><br/>" % root_path)
+                
+                # Identical renders are served from memory, without building the graph.
+                render_key = get_render_key('image' if with_image else 'text', edges, pods_details)
+                rendered = renders.get(render_key)
+                if not rendered:
+                    graph, cycles = build()
+                    rendered = self.render(graph, pods_details, with_image, cycles)
+                    renders.put(render_key, rendered)
+                
+                output_escaped, png, image_map = rendered
+                out.write(output_escaped)
+                if png:
+                    # The image is kept in memory (under the render key) until fetched by the browser.
+                    images.put(render_key, png)
+                    out.write("<br/><br/><br/>")
+                    out.write('<img src="%s/image/%s.png" usemap="#map1"/>' % (root_path, render_key))
+                    out.write(image_map)
+                    out.write("<br/><br/>")  
+                    
+                out.write('<br/><br/><br/><span class="footer"><a href="https://github.com/pferrot/ochograph" target="_blank">Ochograph on GitHub</a></span><br/><br/>')                   
+                return render_key, out.getvalue()
+                
+            # Sends a 200 response with the given body, compressed if large enough and if the client accepts it. The
+            # compressed bytes are cached under the given key (if any) so that the same body is only compressed once.
+            def send_body(self, ctype, body, with_content, key=None, headers=None):
+                coding = get_encoding(self.headers.getheader('Accept-Encoding')) if len(body) >= COMPRESS_MIN_SIZE else None
+                if coding:
+                    data = encoded.get((key, coding)) if key else None
+                    if data is None:
+                        data = encode(body, coding)
+                        if key:
+                            encoded.put((key, coding), data)
+                    body = data
+                
+                self.send_response(200)
+                self.send_header("Content-type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Vary", "Accept-Encoding")
+                if coding:
+                    self.send_header("Content-Encoding", coding)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if with_content:
+                    self.wfile.write(body)
+                
+            # Starts a response whose body is written as it goes (see write_stream()), using the chunked transfer
+            # encoding if the client speaks HTTP/1.1. The connection is closed at the end in any case, which is how
+            # HTTP/1.0 clients know the body is complete.
+            def start_stream(self, ctype):
+                self.chunked = self.request_version == 'HTTP/1.1'
+                if self.chunked:
+                    self.protocol_version = 'HTTP/1.1'
+                self.send_response(200)
+                self.send_header("Content-type", ctype)
+                self.send_header("Cache-Control", "no-cache")
+                if self.chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = 1
+                
+            def write_stream(self, data):
+                if data:
+                    if isinstance(data, unicode):
+                        data = data.encode('utf-8')
+                    if self.chunked:
+                        data = '%x\r\n%s\r\n' % (len(data), data)
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                    
+            def end_stream(self):
+                if self.chunked:
+                    self.wfile.write('0\r\n\r\n')
+                
+            # Returns the log buffer of a given pod (e.g. 'dev.cr-app #31'), created the first time around.
+            def get_log_tail(self, pod_id):
+                log_tail = log_tails.get(pod_id)
+                if not log_tail:
+                    log_tail = _LogTail(lambda: get_pod_replies(is_local, pod_id, ['log'])['log'])
+                    log_tails.put(pod_id, log_tail)
+                return log_tail
+                
+            def write_info(self, info):
+                self.write_stream('<span class="modalSectionHeader">Info:</span><br/>')
+                if info:                                
+                    try:
+                        info_formated = json.dumps(info, sort_keys=True, indent=2, separators=(',', ': '))
+                        self.write_stream(self.escape_html(info_formated));
+                    except Exception:
+                        logger.warn('Error reading info', exc_info=True)
+                        self.write_stream(self.escape_html(info));
+                else:
+                    self.write_stream('N/A')
+                    
+            def write_log(self, entries, header=True, empty='N/A<br/>'):
+                if header:
+                    self.write_stream('<br/><br/><span class="modalSectionHeader">Logs:</span><br/>')
+                if entries:
+                    self.write_stream("".join(self.escape_html(entry[2]) for entry in entries))
+                else:
+                    self.write_stream(empty)
+                
+            # Returns the URL of a static asset (e.g. 'css/style.css'), versioned so that browsers can cache it for good.
+            def asset_url(self, path):
+                url = '%s/%s' % (root_path, path)
+                return '%s?v=%s' % (url, assets[url].version)
+                
+            # Serves a static asset from memory, gzipped if the client accepts it. Versioned URLs (see asset_url())
+            # can be cached for good, the others must be revalidated, in which case 304 is returned if unchanged.
+            def send_asset(self, asset, versioned, with_content):
+                body = asset.body
+                etag = asset.etag
+                gzipped = asset.gzipped and accepts_encoding(self.headers.getheader('Accept-Encoding'), 'gzip')
+                if gzipped:
+                    body = asset.gzipped
+                    etag = '"%s-gzip"' % asset.etag[1:-1]
                 
-                while True:
-                    file_name = "ochograph_" + id_generator() + ".png"
-                    if not os.path.exists(file_name):
-                        return file_name  
+                not_modified = False
+                if_none_match = self.headers.getheader('If-None-Match')
+                if_modified_since = self.headers.getheader('If-Modified-Since')
+                if if_none_match:
+                    not_modified = if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+                elif if_modified_since:
+                    since = email.utils.parsedate_tz(if_modified_since)
+                    not_modified = since is not None and email.utils.mktime_tz(since) >= asset.modified
+                
+                self.send_response(304 if not_modified else 200)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", self.date_time_string(asset.modified))
+                self.send_header("Cache-Control", ("public, max-age=%d" % ASSET_MAX_AGE) if versioned else "no-cache")
+                if asset.gzipped:
+                    self.send_header("Vary", "Accept-Encoding")
+                if not not_modified:
+                    self.send_header("Content-type", asset.ctype)
+                    self.send_header("Content-Length", str(len(body)))
+                    if gzipped:
+                        self.send_header("Content-Encoding", "gzip")
+                self.end_headers()
+                if with_content and not not_modified:
+                    self.wfile.write(body)
                 
             # Thanks to http://patorjk.com/software/taag
-            def write_nice_title(self):
-                self.wfile.write("<a href=\"%s\" class=\"noLinkDeco\"><div class=\"title\">" % root_path if root_path else '/');
+            def write_nice_title(self, out=None):
+                out = out or self.wfile
+                out.write("<a href=\"%s\" class=\"noLinkDeco\"><div class=\"title\">" % (root_path if root_path else '/'));
                 """
-                self.wfile.write(self.escape_html("    ____       _                                 _         \n"));
-                self.wfile.write(self.escape_html("   / __ \     | |                               | |        \n"));
-                self.wfile.write(self.escape_html("  | |  | | ___| |__   ___   __ _ _ __ __ _ _ __ | |__      \n"));
-                self.wfile.write(self.escape_html("  | |  | |/ __| '_ \ / _ \ / _` | '__/ _` | '_ \| '_ \     \n"));
-                self.wfile.write(self.escape_html("  | |__| | (__| | | | (_) | (_| | | | (_| | |_) | | | |    \n"));
-                self.wfile.write(self.escape_html("   \____/ \___|_| |_|\___/ \__, |_|  \__,_| .__/|_| |_|    \n"));
-                self.wfile.write(self.escape_html("                            __/ |         | |              \n"));
-                self.wfile.write(self.escape_html("                           |___/          |_|              \n"));
+                out.write(self.escape_html("    ____       _                                 _         \n"));
+                out.write(self.escape_html("   / __ \     | |                               | |        \n"));
+                out.write(self.escape_html("  | |  | | ___| |__   ___   __ _ _ __ __ _ _ __ | |__      \n"));
+                out.write(self.escape_html("  | |  | |/ __| '_ \ / _ \ / _` | '__/ _` | '_ \| '_ \     \n"));
+                out.write(self.escape_html("  | |__| | (__| | | | (_) | (_| | | | (_| | |_) | | | |    \n"));
+                out.write(self.escape_html("   \____/ \___|_| |_|\___/ \__, |_|  \__,_| .__/|_| |_|    \n"));
+                out.write(self.escape_html("                            __/ |         | |              \n"));
+                out.write(self.escape_html("                           |___/          |_|              \n"));
                 """
                 
-                self.wfile.write(self.escape_html("   ____       __                                 __    \n"));
-                self.wfile.write(self.escape_html("  / __ \_____/ /_  ____  ____ __________ _____  / /_   \n"));
-                self.wfile.write(self.escape_html(" / / / / ___/ __ \/ __ \/ __ `/ ___/ __ `/ __ \/ __ \  \n"));
-                self.wfile.write(self.escape_html("/ /_/ / /__/ / / / /_/ / /_/ / /  / /_/ / /_/ / / / /  \n"));
-                self.wfile.write(self.escape_html("\____/\___/_/ /_/\____/\__, /_/   \__,_/ .___/_/ /_/   \n")); 
-                self.wfile.write(self.escape_html("                      /____/          /_/              \n"));            
+                out.write(self.escape_html("   ____       __                                 __    \n"));
+                out.write(self.escape_html("  / __ \_____/ /_  ____  ____ __________ _____  / /_   \n"));
+                out.write(self.escape_html(" / / / / ___/ __ \/ __ \/ __ `/ ___/ __ `/ __ \/ __ \  \n"));
+                out.write(self.escape_html("/ /_/ / /__/ / / / /_/ / /_/ / /  / /_/ / /_/ / / / /  \n"));
+                out.write(self.escape_html("\____/\___/_/ /_/\____/\__, /_/   \__,_/ .___/_/ /_/   \n")); 
+                out.write(self.escape_html("                      /____/          /_/              \n"));            
                     
-                self.wfile.write("</div></a><br/>")                 
+                out.write("</div></a><br/>")                 
                 
             def do(self, method):
                 with_content = method != 'HEAD'
                 if method == 'GET' or method == 'HEAD':
-                    if self.path == '%s'  % root_path if root_path else '/':
+                    if self.path == (root_path if root_path else '/'):
                         self.send_response(200)
                         self.send_header("Content-type", "text/html")
                         self.end_headers()
                         if with_content:
                             self.wfile.write("<html><head><title>Ochograph</title>")
-                            self.wfile.write('<link rel="stylesheet" type="text/css" href="%s/css/style.css">' % root_path)
+                            self.wfile.write('<link rel="stylesheet" type="text/css" href="%s">' % self.asset_url('css/style.css'))
                             self.wfile.write('</head>')
                             self.wfile.write("<body>")
                             
@@ -696,80 +2524,91 @@ if __name__ == '__main__':
                     elif self.path.startswith("%s/data" % root_path):
                         up = urlparse.urlparse(self.path)
                         if up.path == ('%s/data' % root_path):
+                            # No I/O here: simply serve whatever the background refresher built last, only what
+                            # changed since the given version if any.
+                            qs = urlparse.parse_qs(up.query)
+                            try:
+                                since = int(qs['since'][0]) if qs.has_key('since') else None
+                            except ValueError:
+                                since = None
+                            snapshot, body = refresher.since(since)
+                            if not snapshot:
+                                self.send_error(503, "Pods details not available yet")
+                            else:
+                                key = ('data', snapshot.version, None if body is snapshot.body else since)
+                                self.send_body("application/json", body, with_content, key,
+                                               {"X-Snapshot-Version": str(snapshot.version)})
+                        else:
+                            self.send_error(404, "File not found: %s " % self.path)
+                    elif self.path.startswith("%s/events" % root_path):
+                        up = urlparse.urlparse(self.path)
+                        if up.path == ('%s/events' % root_path):
+                            # Browsers send back the id of the last event they got when reconnecting.
+                            qs = urlparse.parse_qs(up.query)
+                            try:
+                                version = int(self.headers.getheader('Last-Event-ID') or qs.get('version', ['0'])[0])
+                            except ValueError:
+                                version = 0
                             self.send_response(200)
-                            self.send_header("Content-type", "application/json")
+                            self.send_header("Content-type", "text/event-stream")
+                            self.send_header("Cache-Control", "no-cache")
                             self.end_headers()
                             if with_content:
-                                the_graph, pods_details, output = get_graph()
-                                # Remove 'uptime' and all other metrics except 'dependsOn' here since 
-                                # it would always trigger a refresh even for no valid reason.
-                                try:
-                                    for pod_details in pods_details.values():
-                                        body = pod_details[1]
-                                        if body.has_key('metrics'):
-                                            metrics = body['metrics']
-                                            for the_key in metrics.keys():
-                                                # Keep 'dependsOn' since we use it to generate the graph.
-                                                if the_key != 'dependsOn':
-                                                    del metrics[the_key]
-                                except Exception:
-                                    logger.error('Error removing uptime key from pod details', exc_info=True)
-                                result_json = {'graph': json_graph.node_link_data(the_graph), 'podsDetails': pods_details}                        
-                                self.wfile.write(json.dumps(result_json, sort_keys=True))
+                                self.push_events(version)
                         else:
                             self.send_error(404, "File not found: %s " % self.path)
                     elif self.path.startswith("%s/image/" % root_path) and self.path.endswith(".png"):
-                        image_name = self.path[self.path.rfind("/")+1:]
-                        if not os.path.exists(image_name):
+                        image_id = self.path[self.path.rfind("/")+1:-4]
+                        png = images.get(image_id)
+                        if not png:
                             self.send_error(404, "File not found: %s " % self.path)
                         else:
                             self.send_response(200)
                             self.send_header("Content-type", 'image/png')
+                            self.send_header("Content-Length", str(len(png)))
                             self.end_headers()
                             if with_content:
-                                f = open(image_name, 'rb')
-                                self.wfile.write(f.read())
-                                f.close()
-                                # Delete the image once it has been served.
-                                try:
-                                    os.remove(image_name)
-                                except:
-                                    logger.error("Failed to remove file: %s" % image_name) 
+                                self.wfile.write(png)
                                     
                     elif self.path.startswith('%s/pod/info' % root_path):
                         try:
                             up = urlparse.urlparse(self.path)
-                            command = up.path[up.path.rfind('/')+1:]
-                            if up.path == ('%s/pod/%s' % (root_path, command)):
+                            if up.path == ('%s/pod/info' % root_path):
                                 qs = urlparse.parse_qs(up.query)
                                 pod_id = qs.get("podId")[0]
-                                hash_pos = pod_id.rfind("#")
-                                seq = int(pod_id[hash_pos + 1:])
-                                cluster = pod_id[0:hash_pos - 1]
-                                pod_details = get_pods_details(is_local, "", True, cluster, [seq], command)
-                                
-                                if pod_details[0].has_key(pod_id):
-                                    d = pod_details[0].get(pod_id);
-                                    info = d[1]
-                                    #if info.has_key('metrics'):
-                                    #    metrics = d[1]['metrics']
-                                        
-                                self.send_response(200)
-                                self.send_header("Content-type", "text/html")
-                                self.end_headers()
+                                info = get_pod_replies(is_local, pod_id, ['info'])['info']
                                 
-                                self.wfile.write('<span class="modalSectionHeader">Info:</span><br/>')
-                                if info:                                
-                                    try:
-                                        info_formated = json.dumps(info, sort_keys=True, indent=2, separators=(',', ': '))
-                                        self.wfile.write(self.escape_html(info_formated));
-                                    except Exception:
-                                        logger.warn('Error reading info', exc_info=True)
-                                        self.wfile.write(self.escape_html(info));
-                                else:
-                                    self.wfile.write('N/A')
-                                        
+                                self.start_stream("text/html")
+                                if with_content:
+                                    self.write_info(info)
+                                self.end_stream()
+                            else:
+                                self.send_error(404, "File not found: %s " % self.path)
+                        # E.g. if the pod is not found.
+                        except Exception:
+                            logger.error('Error retrieving pod details', exc_info=True)
+                            self.send_error(404, "File not found: %s " % self.path)
+                    elif self.path.startswith('%s/pod/details' % root_path):
+                        try:
+                            up = urlparse.urlparse(self.path)
+                            if up.path == ('%s/pod/details' % root_path):
+                                # Info and log (the last <tail> lines if given) queried at the same time. The number
+                                # of the last line is passed along so that the log can then be followed from there.
+                                qs = urlparse.parse_qs(up.query)
+                                pod_id = qs.get("podId")[0]
+                                tail = int(qs['tail'][0]) if qs.has_key('tail') else None
+                                replies = get_pod_replies(is_local, pod_id, ['info', 'log'])
+                                log_tail = self.get_log_tail(pod_id)
+                                log_tail.update(replies['log'])
+                                entries = log_tail.get(tail)
+                                last = entries[-1][0] if entries else log_tail.count - 1
                                 
+                                self.start_stream("text/html")
+                                if with_content:
+                                    self.write_info(replies['info'])
+                                    self.write_log(entries)
+                                    self.write_stream('<span class="podLogEnd" data-after="%d"></span>' % last)
+                                self.end_stream()
                             else:
                                 self.send_error(404, "File not found: %s " % self.path)
                         # E.g. if the pod is not found.
@@ -779,40 +2618,67 @@ if __name__ == '__main__':
                     elif self.path.startswith('%s/pod/log' % root_path):
                         try:
                             up = urlparse.urlparse(self.path)
-                            command = up.path[up.path.rfind('/')+1:]
-                            if up.path == ('%s/pod/%s' % (root_path, command)):
+                            if up.path == ('%s/pod/log' % root_path):
+                                # Optionally the last <tail> lines, the ones logged <since> a given time, the ones
+                                # after a given line number (without the section header, see /pod/details) and/or new
+                                # lines pushed as they come for up to LOG_FOLLOW seconds (follow=1).
                                 qs = urlparse.parse_qs(up.query)
                                 pod_id = qs.get("podId")[0]
-                                hash_pos = pod_id.rfind("#")
-                                seq = int(pod_id[hash_pos + 1:])
-                                cluster = pod_id[0:hash_pos - 1]
-                                command_result = get_pods_details(is_local, "", True, cluster, [seq], command)[0]
-                                self.send_response(200)
-                                self.send_header("Content-type", "text/html")
-                                self.end_headers()
-                                
-                                self.wfile.write('<br/><br/><span class="modalSectionHeader">Logs:</span><br/>')
-                                if command_result:
-                                    try:
-                                        lines = command_result.values()[0][1]                  
-                                        for one_log in lines:
-                                            self.wfile.write(self.escape_html(one_log));
-                                    except Exception:
-                                        logger.warn('Error reading logs', exc_info=True)
-                                        self.wfile.write('N/A')
-                                        self.wfile.write("<br/>");
-                                        
-                                else:
-                                    self.wfile.write('N/A')
-                                    self.wfile.write("<br/>");
-                                        
+                                tail = int(qs['tail'][0]) if qs.has_key('tail') else None
+                                since = qs.get('since', [None])[0]
+                                after = int(qs['after'][0]) if qs.has_key('after') else None
+                                follow = qs.get('follow', ['0'])[0] in ('1', 'true')
+                                log_tail = self.get_log_tail(pod_id)
+                                log_tail.refresh()
+                                entries = log_tail.get(tail, since, after)
+                                last = entries[-1][0] if entries else (after if after is not None else log_tail.count - 1)
                                 
+                                self.start_stream("text/html")
+                                if with_content:
+                                    self.write_log(entries, after is None, '' if follow else 'N/A<br/>')
+                                    
+                                    ts = time.time()
+                                    while follow and time.time() - ts < LOG_FOLLOW:
+                                        time.sleep(LOG_REFRESH)
+                                        log_tail.refresh()
+                                        entries = log_tail.get(after=last)
+                                        if entries:
+                                            last = entries[-1][0]
+                                            self.write_log(entries, False)
+                                        else:
+                                            #
+                                            # - an empty comment when there is nothing new, so that a client gone
+                                            #   away is noticed (socket.error) instead of being followed until the end
+                                            #
+                                            self.write_stream('<!-- -->')
+                                self.end_stream()
                             else:
                                 self.send_error(404, "File not found: %s " % self.path)
+                        except socket.error:
+                            logger.debug('Client gone, no longer streaming the log')
                         # E.g. if the pod is not found.
                         except Exception:
                             logger.error('Error retrieving pod details', exc_info=True)
                             self.send_error(404, "File not found: %s " % self.path)
+                    elif self.path.startswith('%s/text/content' % root_path) or self.path.startswith('%s/image/content' % root_path):
+                        up = urlparse.urlparse(self.path)
+                        if up.path == '%s/image/content' % root_path or up.path == '%s/text/content' % root_path:
+                            # Rendered straight from the snapshot with the given version (the latest one if unknown).
+                            qs = urlparse.parse_qs(up.query)
+                            try:
+                                version = int(qs['version'][0]) if qs.has_key('version') else None
+                            except ValueError:
+                                version = None
+                            snapshot = refresher.find(version)
+                            if not snapshot:
+                                self.send_error(503, "Pods details not available yet")
+                            else:
+                                render_key, html = self.get_content(up.path == ('%s/image/content' % root_path), snapshot.graph.edges(),
+                                                                    snapshot.pods_details, lambda: (snapshot.graph, snapshot.cycles))
+                                self.send_body("text/html", html, with_content, ('content', render_key),
+                                               {"X-Snapshot-Version": str(snapshot.version)})
+                        else:
+                            self.send_error(404, "File not found: %s " % self.path)
                     elif self.path.startswith('%s/text' % root_path) or self.path.startswith('%s/image' % root_path):     
                         up = urlparse.urlparse(self.path)
                         if up.path == ('%s/image' % root_path) or up.path == ('%s/text' % root_path):                    
@@ -822,12 +2688,11 @@ if __name__ == '__main__':
                             self.end_headers()
                             if with_content:
                                 self.wfile.write("<html><head><title>Ochograph</title>")
-                                self.wfile.write('<link rel="stylesheet" type="text/css" href="%s/css/style.css">' %  root_path)
-                                self.wfile.write('<script src="%s/javascript/javascript.js"></script>' % root_path)
-                                self.wfile.write('<script src="%s/javascript/javascript.js"></script>' % root_path)
-                                self.wfile.write('<script src="%s/javascript/jquery-1.11.3.min.js"></script>' % root_path)
-                                self.wfile.write('<script src="%s/javascript/jquery-ui-1.11.4.custom/jquery-ui.js"></script>' % root_path)
-                                self.wfile.write('<link rel="stylesheet" type="text/css" href="%s/javascript/jquery-ui-1.11.4.custom/jquery-ui.css">' % root_path)
+                                self.wfile.write('<link rel="stylesheet" type="text/css" href="%s">' % self.asset_url('css/style.css'))
+                                self.wfile.write('<script src="%s"></script>' % self.asset_url('javascript/javascript.js'))
+                                self.wfile.write('<script src="%s"></script>' % self.asset_url('javascript/jquery-1.11.3.min.js'))
+                                self.wfile.write('<script src="%s"></script>' % self.asset_url('javascript/jquery-ui-1.11.4.custom/jquery-ui.js'))
+                                self.wfile.write('<link rel="stylesheet" type="text/css" href="%s">' % self.asset_url('javascript/jquery-ui-1.11.4.custom/jquery-ui.css'))
                                 self.wfile.write('<script type="text/javascript">')
                                 self.wfile.write('$( document ).ready(function() {');
                                 self.wfile.write('  loadContent(%s, \'%s\');' % ('true' if up.path == ('%s/image' % root_path) else 'false', root_path));                            
@@ -840,41 +2705,13 @@ if __name__ == '__main__':
                                 self.wfile.write("</body></html>")
                         else:
                             self.send_error(404, "File not found: %s " % self.path)                           
-                    elif self.path == '%s/css/style.css' % root_path:
-                        self.send_response(200)
-                        self.send_header("Content-type", "text/css")
-                        self.end_headers()      
-                        if with_content:              
-                            f = open('css/style.css')
-                            self.wfile.write(f.read())
-                            f.close() 
-                    elif self.path == ('%s/javascript/javascript.js' % root_path) or self.path == ('%s/javascript/jquery-1.11.3.min.js' % root_path):
-                        self.send_response(200)
-                        self.send_header("Content-type", "text/javascript")
-                        self.end_headers()
-                        if with_content:                    
-                            f = open(self.path[1 + len(root_path):])
-                            self.wfile.write(f.read())
-                            f.close() 
-                    elif self.path.startswith('%s/javascript/jquery-ui-1.11.4.custom' % root_path):
-                        if os.path.isfile(self.path[1 + len(root_path):]) and (self.path.endswith('.png') or self.path.endswith('.css') or self.path.endswith('.js')):
-                            #file_name = self.path[self.path.rfind("/")+1]
-                            self.send_response(200)
-                            if self.path.endswith(".png"):
-                                self.send_header("Content-type", 'image/png')
-                                f = open(self.path[1 + len(root_path):], 'rb')
-                            elif self.path.endswith(".css"):
-                                self.send_header("Content-type", "text/css")
-                                f = open(self.path[1 + len(root_path):])
-                            elif self.path.endswith(".js"):
-                                self.send_header("Content-type", "text/javascript")
-                                f = open(self.path[1 + len(root_path):])
-                            self.end_headers()
-                            if with_content:
-                                self.wfile.write(f.read())
-                                
-                        else:
-                            self.send_error(404, "File not found: %s " % self.path)
+                    elif self.path == ('%s/metrics' % root_path):
+                        self.send_body("text/plain; version=0.0.4", _metrics.render(), with_content)
+                    elif urlparse.urlparse(self.path).path in assets:
+                        up = urlparse.urlparse(self.path)
+                        asset = assets[up.path]
+                        versioned = urlparse.parse_qs(up.query).get('v') == [asset.version]
+                        self.send_asset(asset, versioned, with_content)
                     else:
                         self.send_error(404, "File not found: %s " % self.path)
                 elif method == 'POST':
@@ -883,92 +2720,54 @@ if __name__ == '__main__':
                         if self.path.startswith('%s/text/content' % root_path) or self.path.startswith('%s/image/content' % root_path):
                             up = urlparse.urlparse(self.path)
                             if up.path == '%s/image/content' % root_path or up.path == '%s/text/content' % root_path:                    
-                                qs = urlparse.parse_qs(up.query)
-                                self.send_response(200)
-                                self.send_header("Content-type", "text/html")
-                                self.end_headers()
-                                if with_content:
-                                    length = int(self.headers.getheader('content-length'))
-                                    data = self.rfile.read(length)
-                                    
-                                    self.write_nice_title();
-                                    
-                                    image_file = None
-                                    self.wfile.write("<span class=\"small\" title=\"Last time a check was made in the background to see if what you see is still up-to-date.\">Last check date: <span id=\"lastCheckDate\"></span></span><br/>")
-                                    self.wfile.write("<span class=\"small\" title=\"Last time what you see on the screen was updated, i.e. something changed in the pods settings.\">Last update date: <span id=\"lastUpdateDate\"></span></span><br/>")
-                                    if up.path == ('%s/text/content' % root_path):
-                                        self.wfile.write("<span class=\"small\"><a href=\"%s/image\">Go to image mode</a></span><br/><br/>" % root_path)
-                                    elif up.path == ('%s/image/content' % root_path):
-                                        self.wfile.write("<span class=\"small\"><a href=\"%s/text\">Go to text mode</a></span><br/><br/>" % root_path)
-                                        image_file = self.get_random_image_name()
-                                        
-                                    data_json = json.loads(data)
-                                    
-                                    graph_json = data_json['graph']
-                                    graph = json_graph.node_link_graph(graph_json)
-                                    pods_details = data_json['podsDetails']
-                                    
-                                    #graph, pods_details, output = get_graph()
-                                    output, graph_generated, a_graph = get_output(graph, pods_details, "", image_file)
-                                    
-                                    output_escaped = self.escape_html(output)
-                                    
-                                    # Allow clicking a pod in text mode as well.
-                                    for n in graph.nodes():
-                                        if n != ROOT_NODE:
-                                            output_escaped = output_escaped.replace(self.escape_html(n), ("<span class=\"textNodeLink\" onclick=\"nodeClicked('%s', '%s');\">" + self.escape_html(n) + "</span>") % (n, root_path))
-                                    
-                                    self.wfile.write(output_escaped)
-                                    if image_file and graph_generated:
-                                        self.wfile.write("<br/><br/><br/>")
-                                        self.wfile.write('<img src="%s/image/%s" usemap="#map1"/>' % (root_path, image_file))
-                                        with open(image_file, 'rb') as f:
-                                            data = f.read()
-                                        image_info = get_image_info(data)                       
-        
-                                        graphviz_info = get_graphviz_info(a_graph)
-                                        
-                                        g_width = graphviz_info[0][2] - graphviz_info[0][0]
-                                        g_height = graphviz_info[0][3] - graphviz_info[0][1] 
-                                        
-                                        # We need to compare the image size with the dimensions of the graph to properly
-                                        # calculate nodes positions on the image.
-                                        ratio_w = g_width / image_info[0]
-                                        ratio_h = g_height / image_info[1]
-                                        
-                                        
-                                        area_width=80
-                                        area_height=25
-                                        
-                                        self.wfile.write('<map name="map1">')
-                                        for node in graphviz_info[1].keys():
-                                            v = graphviz_info[1].get(node)
-                                            x = v[0] / ratio_w
-                                            y = image_info[1] - (v[1] / ratio_w)
-                                            x1 = x - (area_width / 2)
-                                            y1 = y - (area_height / 2)
-                                            x2 = x + (area_width / 2)
-                                            y2 = y + (area_height / 2)
-                                            self.wfile.write('<area shape="rect" coords="%s,%s,%s,%s" href="javascript: void(0);" onclick="nodeClicked(\'%s\', \'%s\');">' % (int(x1), int(y1), int(x2), int(y2), node, root_path))
-                                        self.wfile.write('</map')
-                                        
-                                        self.wfile.write("<br/><br/>")  
-                                        
-                                    self.wfile.write('<br/><br/><br/><span class="footer"><a href="https://github.com/pferrot/ochograph" target="_blank">Ochograph on GitHub</a></span><br/><br/>')                   
+                                length = int(self.headers.getheader('content-length'))
+                                data = self.rfile.read(length)
+                                
+                                data_json = json.loads(data)
+                                
+                                graph_json = data_json['graph']
+                                pods_details = dict((key, _Pod(key, *value)) for key, value in data_json['podsDetails'].items())
+                                nodes = [n['id'] for n in graph_json['nodes']]
+                                edges = [(nodes[l['source']], nodes[l['target']]) for l in graph_json['links']]
+                                render_key, html = self.get_content(up.path == ('%s/image/content' % root_path), edges, pods_details,
+                                                                    lambda: (json_graph.node_link_graph(graph_json), None))
+                                self.send_body("text/html", html, with_content, ('content', render_key))
                             else:
                                 self.send_error(404, "File not found: %s " % self.path)
                         # Not application/json
                         else:
                             self.send_error(404, "File not found: %s " % self.path)
                     
+            # Counts the bytes written (see instrumented()).
+            def setup(self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                self.wfile = _CountingFile(self.wfile)
+                
+            def send_response(self, code, message=None):
+                self.status = code
+                BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message)
+                
+            # Handles a request, keeping track of the requests in flight, their status and response size (see /metrics).
+            def instrumented(self, method):
+                _metrics.inc('ochograph_http_in_flight')
+                written = self.wfile.count
+                self.status = None
+                try:
+                    self.do(method)
+                finally:
+                    _metrics.inc('ochograph_http_in_flight', -1)
+                    # No status if do() failed before responding, the client then getting nothing.
+                    _metrics.inc('ochograph_http_requests_total', method=method, code=self.status or 500)
+                    _metrics.observe('ochograph_http_response_bytes', self.wfile.count - written)
+                
             def do_HEAD(self):
-                self.do('HEAD')
+                self.instrumented('HEAD')
                     
             def do_GET(self):
-                self.do('GET')
+                self.instrumented('GET')
                 
             def do_POST(self):
-                self.do('POST')
+                self.instrumented('POST')
                 
             def log_error(self, form, *args):
                 logger.error(form % args)
@@ -979,6 +2778,9 @@ if __name__ == '__main__':
                 
         class ThreadedHTTPServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
             """Handle requests in a separate thread."""
+            
+            # Do not wait for the clients listening to events when stopping.
+            daemon_threads = True
     
         server = ThreadedHTTPServer((HOST_NAME, port_number), MyHandler)
         logger.info("Server Starts - %s:%s" % (HOST_NAME, port_number))
@@ -994,13 +2796,17 @@ if __name__ == '__main__':
         print "\nOchograph"
         print "=========\n"
             
-        graph, pods_details, output = get_graph()
-        output, graph_generated, a_graph =  get_output(graph, pods_details, output, image_file)
+        graph, pods_details, output, _ = get_graph()
+        # Printed as it goes rather than once everything is drawn.
+        _, graph_generated, a_graph =  get_output(graph, pods_details, output, image_file is not None, write=sys.stdout.write)
         
-        print output
+        print ''
         
         if image_file and graph_generated:
+            a_graph.draw(image_file)
             print "Image has been created here: %s" % image_file
+        
+        stop_topologies()
          
         # I find this more readable to finish with a new line :-)    
         print ''   
@@ -65,8 +65,11 @@ if __name__ == '__main__':
             port_number = cfg['port_number'] if 'port_number' in cfg.keys() else None
             logger.debug("Using custom port number: %s" % port_number if port_number else "<no>")
             
+            refresh_interval = cfg['refresh_interval'] if 'refresh_interval' in cfg.keys() else None
+            logger.debug("Using custom refresh interval: %s" % refresh_interval if refresh_interval else "<no>")
+            
             log_level = cfg['log_level'] if 'log_level' in cfg.keys() else "WARNING"
             
-            return 'python ochograph.py -w %s %s %s' % (("-r %s" % root_path if root_path else ""), ("-p %s" % port_number if port_number else ""), ("--log %s" % log_level)), {}
+            return 'python ochograph.py -w %s %s %s %s' % (("-r %s" % root_path if root_path else ""), ("-p %s" % port_number if port_number else ""), ("--refresh %s" % refresh_interval if refresh_interval else ""), ("--log %s" % log_level)), {}
 
     Pod().boot(Strategy)
\ No newline at end of file